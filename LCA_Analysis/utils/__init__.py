@@ -0,0 +1,32 @@
+"""
+Utility modules for the LCA analysis.
+
+Submodules are imported lazily on first attribute access, so
+``import LCA_Analysis.utils`` does not load pandas, matplotlib, seaborn or
+scikit-learn until a submodule that needs them is actually used.
+"""
+import importlib
+
+__all__ = [
+    "aggregates",
+    "assignment_store",
+    "data_preprocessing",
+    "data_postprocessing",
+    "evaluation",
+    "lca",
+    "significance",
+    "stratified",
+    "visualization",
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        module = importlib.import_module(f".{name}", __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
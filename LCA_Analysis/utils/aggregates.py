@@ -0,0 +1,175 @@
+import numpy as np
+
+# Whisker reach in IQRs, as in matplotlib and seaborn box plots
+DEFAULT_WHIS = 1.5
+
+
+def value_sketch(df, value_column, group_column="class_assignment",
+                 resolution=None):
+    """
+    Summarises a column as counts of each distinct value per group. The
+    sketch is mergeable: sketches of chunks or shards of the cohort add up
+    to the sketch of the whole cohort (see merge_value_sketches).
+
+    Quantiles from the sketch are exact for integer scores such as age,
+    SOFA and OASIS. For continuous values, pass a resolution to round the
+    values first, which bounds the sketch size and the quantile error.
+
+    Parameters:
+    - df (pd.DataFrame): Data with the value and group columns.
+    - value_column (str): Column to summarise.
+    - group_column (str): Group column. Default is "class_assignment".
+    - resolution (float): Round values to multiples of this. Default keeps
+      the values as they are.
+
+    Returns:
+    - pd.Series: Counts indexed by (group, value), sorted. Missing values
+      are left out.
+    """
+    data = df[[group_column, value_column]].dropna()
+    values = data[value_column]
+    if resolution is not None:
+        values = (values / resolution).round() * resolution
+    return (
+        data.assign(**{value_column: values})
+        .groupby([group_column, value_column], observed=True)
+        .size()
+        .rename("count")
+        .sort_index()
+    )
+
+
+def merge_value_sketches(sketches):
+    """
+    Combines sketches of different chunks or shards.
+
+    Parameters:
+    - sketches (list): Outputs of value_sketch for the same column.
+
+    Returns:
+    - pd.Series: The merged sketch.
+    """
+    import pandas as pd
+
+    merged = pd.concat(list(sketches))
+    return (
+        merged.groupby(level=list(range(merged.index.nlevels)))
+        .sum()
+        .rename("count")
+        .sort_index()
+    )
+
+
+def _weighted_quantiles(values, counts, quantiles):
+    """
+    Quantiles of values repeated counts times, with the same linear
+    interpolation as np.percentile on the expanded data.
+
+    Parameters:
+    - values (np.ndarray): Sorted distinct values.
+    - counts (np.ndarray): Count of each value.
+    - quantiles (np.ndarray): Quantiles between 0 and 1.
+
+    Returns:
+    - np.ndarray: Quantile values.
+    """
+    cumulative = np.cumsum(counts)
+    position = (cumulative[-1] - 1) * np.asarray(quantiles, dtype=np.float64)
+    lower = np.floor(position)
+    # Value at 0-based rank r in the expanded data
+    lower_value = values[np.searchsorted(cumulative, lower, side="right")]
+    upper_value = values[
+        np.searchsorted(cumulative, np.ceil(position), side="right")
+    ]
+    return lower_value + (position - lower) * (upper_value - lower_value)
+
+
+def sketch_quantiles(sketch, quantiles=(0.25, 0.5, 0.75)):
+    """
+    Quantiles per group from a value sketch.
+
+    Parameters:
+    - sketch (pd.Series): Output of value_sketch or merge_value_sketches.
+    - quantiles (tuple): Quantiles between 0 and 1. Default is the
+      quartiles.
+
+    Returns:
+    - pd.DataFrame: One row per group and one column per quantile.
+    """
+    import pandas as pd
+
+    rows = {}
+    for group, counts in sketch.groupby(level=0, sort=True):
+        rows[group] = _weighted_quantiles(
+            counts.index.get_level_values(1).to_numpy(dtype=np.float64),
+            counts.to_numpy(),
+            quantiles,
+        )
+    return pd.DataFrame.from_dict(rows, orient="index", columns=quantiles)
+
+
+def sketch_box_stats(sketch, whis=DEFAULT_WHIS):
+    """
+    Box plot statistics per group from a value sketch, in the format of
+    matplotlib's Axes.bxp and with the same definitions as plt.boxplot and
+    sns.boxplot: quartiles with linear interpolation, whiskers at the most
+    extreme values within whis * IQR of the box, and the values beyond as
+    fliers.
+
+    Each distinct flier value is returned once, since repeated fliers are
+    drawn on top of each other anyway.
+
+    Parameters:
+    - sketch (pd.Series): Output of value_sketch or merge_value_sketches.
+    - whis (float): Whisker reach in IQRs. Default is 1.5.
+
+    Returns:
+    - list: One dict per group, ordered by group, with 'label', 'med',
+      'q1', 'q3', 'whislo', 'whishi', 'fliers', 'mean' and 'n'.
+    """
+    stats = []
+    for group, counts in sketch.groupby(level=0, sort=True):
+        values = counts.index.get_level_values(1).to_numpy(dtype=np.float64)
+        counts = counts.to_numpy()
+        q1, med, q3 = _weighted_quantiles(values, counts, (0.25, 0.5, 0.75))
+        iqr = q3 - q1
+        inside = (values >= q1 - whis * iqr) & (values <= q3 + whis * iqr)
+        stats.append({
+            "label": group,
+            "med": med,
+            "q1": q1,
+            "q3": q3,
+            "whislo": values[inside].min() if inside.any() else q1,
+            "whishi": values[inside].max() if inside.any() else q3,
+            "fliers": values[~inside],
+            "mean": np.average(values, weights=counts),
+            "n": int(counts.sum()),
+        })
+    return stats
+
+
+def bubble_points(df, x="class_assignment", y="count_morbidity",
+                  size="percent"):
+    """
+    Distinct bubbles of a bubble plot: one row per (x, y) combination
+    instead of one per patient.
+
+    If the size column exists (e.g. 'percent' from
+    calculate_percentage_within_subgroup) the distinct (x, y, size) rows
+    are kept. Otherwise the size is computed as the percentage of rows of
+    each x value that have each y value.
+
+    Parameters:
+    - df (pd.DataFrame): Per-patient data.
+    - x (str): Column on the x-axis. Default is "class_assignment".
+    - y (str): Column on the y-axis. Default is "count_morbidity".
+    - size (str): Bubble size column. Default is "percent".
+
+    Returns:
+    - pd.DataFrame: Columns x, y and size, one row per bubble.
+    """
+    if size in df:
+        return df[[x, y, size]].drop_duplicates().reset_index(drop=True)
+    counts = df.groupby([x, y], observed=True).size().rename(size)
+    percent = counts / counts.groupby(level=0).transform("sum") * 100
+    return percent.reset_index()
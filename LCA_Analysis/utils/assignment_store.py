@@ -0,0 +1,320 @@
+import json
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Files of one model version inside the store directory
+POSTERIOR_FILE = "posterior.npy"
+ASSIGNMENT_FILE = "class_assignment.npy"
+KEY_INDEX_FILE = "key_index.npy"
+KEY_ORDER_FILE = "key_order.npy"
+HADM_INDEX_FILE = "hadm_index.npy"
+HADM_ORDER_FILE = "hadm_order.npy"
+IDS_FILE = "ids.npy"
+METADATA_FILE = "metadata.json"
+
+# subject_id and hadm_id both fit in 32 bits, so (subject_id, hadm_id) is
+# packed into one sortable int64 key
+KEY_SHIFT = 32
+
+# class_assignment value for rows without a class, as poLCA's predclass for
+# rows dropped because of missing values
+NO_CLASS = 0
+MAX_CLASS = np.iinfo(np.int8).max
+
+
+def _pack_keys(subject_id, hadm_id):
+    """
+    Packs (subject_id, hadm_id) pairs into int64 keys that sort by
+    subject_id first and hadm_id second.
+
+    Parameters:
+    - subject_id (array-like): Non-negative subject ids.
+    - hadm_id (array-like): Non-negative admission ids.
+
+    Returns:
+    - np.ndarray: int64 keys.
+    """
+    subject_id = np.asarray(subject_id, dtype=np.int64)
+    hadm_id = np.asarray(hadm_id, dtype=np.int64)
+    return (subject_id << KEY_SHIFT) | hadm_id
+
+
+def _version_dir(store_dir, model_version):
+    return os.path.join(store_dir, str(model_version))
+
+
+def list_model_versions(store_dir):
+    """
+    Lists the model versions saved in a store, oldest first.
+
+    Parameters:
+    - store_dir (str): Store directory.
+
+    Returns:
+    - list: Model version names, ordered by creation time.
+    """
+    if not os.path.isdir(store_dir):
+        return []
+    versions = []
+    for name in os.listdir(store_dir):
+        path = os.path.join(store_dir, name, METADATA_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                versions.append((json.load(f)["created"], name))
+    return [name for _, name in sorted(versions)]
+
+
+def write_assignment_store(store_dir, model_version, subject_id, hadm_id,
+                           posterior, class_assignment, metadata=None):
+    """
+    Saves posterior probabilities and class assignments of one fitted
+    model as memory-mappable arrays with a sorted patient index.
+
+    The posterior is stored as a float32 (rows x classes) matrix and the
+    class assignment as int8, both in the row order of the input, next to
+    the subject_id and hadm_id of every row. Two
+    sorted indexes map (subject_id, hadm_id) and hadm_id back to row
+    positions.
+
+    Parameters:
+    - store_dir (str): Store directory; one subdirectory is written per
+      model version.
+    - model_version (str): Name of the model, e.g. 'lca_6class_2024_06'.
+      An existing version with the same name is overwritten.
+    - subject_id (array-like): subject_id per row.
+    - hadm_id (array-like): hadm_id per row.
+    - posterior (array-like): Posterior class probabilities, shape
+      (rows, classes), e.g. fit_lca(...)['posterior'] or poLCA's
+      posterior. NaN rows are allowed.
+    - class_assignment (array-like): 1-based class per row; missing values
+      are stored as 0.
+    - metadata (dict): Extra JSON-serializable information about the model,
+      e.g. formula, number of classes, BIC.
+
+    Returns:
+    - str: Directory of the saved model version.
+    """
+    import pandas as pd
+
+    posterior = np.asarray(posterior, dtype=np.float32)
+    if posterior.ndim != 2:
+        raise ValueError("posterior must be a (rows, classes) matrix")
+    n_rows = posterior.shape[0]
+
+    assignment = pd.to_numeric(
+        pd.Series(np.asarray(class_assignment)), errors="coerce"
+    )
+    if len(assignment) != n_rows or len(subject_id) != n_rows \
+            or len(hadm_id) != n_rows:
+        raise ValueError(
+            "subject_id, hadm_id, posterior and class_assignment must have "
+            "the same number of rows"
+        )
+    if assignment.max() > MAX_CLASS:
+        raise ValueError(f"Class labels above {MAX_CLASS} do not fit int8")
+    assignment = assignment.fillna(NO_CLASS).to_numpy(dtype=np.int8)
+
+    keys = _pack_keys(subject_id, hadm_id)
+    key_order = np.argsort(keys, kind="stable")
+    hadm = np.asarray(hadm_id, dtype=np.int64)
+    hadm_order = np.argsort(hadm, kind="stable")
+
+    path = _version_dir(store_dir, model_version)
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, POSTERIOR_FILE), posterior)
+    np.save(os.path.join(path, ASSIGNMENT_FILE), assignment)
+    np.save(
+        os.path.join(path, IDS_FILE),
+        np.column_stack([subject_id, hadm_id]).astype(np.int32),
+    )
+    np.save(os.path.join(path, KEY_INDEX_FILE), keys[key_order])
+    np.save(os.path.join(path, KEY_ORDER_FILE), key_order.astype(np.int64))
+    np.save(os.path.join(path, HADM_INDEX_FILE), hadm[hadm_order])
+    np.save(os.path.join(path, HADM_ORDER_FILE), hadm_order.astype(np.int64))
+
+    with open(os.path.join(path, METADATA_FILE), "w") as f:
+        json.dump(
+            {
+                "model_version": str(model_version),
+                "created": datetime.now(timezone.utc).isoformat(),
+                "n_rows": int(n_rows),
+                "n_classes": int(posterior.shape[1]),
+                **(metadata or {}),
+            },
+            f,
+            indent=2,
+        )
+    return path
+
+
+def write_assignment_store_from_csv(store_dir, model_version,
+                                    latent_class_path, posterior_path,
+                                    metadata=None):
+    """
+    Converts the CSV outputs of LCA_analysis.ipynb
+    (LCA_latent_class_data.csv and LCA_posterior_probabilities.csv, which
+    are aligned by row position) into an assignment store.
+
+    Parameters:
+    - store_dir (str): Store directory.
+    - model_version (str): Name of the model.
+    - latent_class_path (str): CSV with 'subject_id', 'hadm_id' and
+      'class_assignment' columns.
+    - posterior_path (str): CSV with one posterior column per class.
+    - metadata (dict): Extra information about the model.
+
+    Returns:
+    - str: Directory of the saved model version.
+    """
+    import pandas as pd
+
+    ids = pd.read_csv(
+        latent_class_path,
+        usecols=["subject_id", "hadm_id", "class_assignment"],
+    )
+    posterior = pd.read_csv(posterior_path, dtype=np.float32)
+    return write_assignment_store(
+        store_dir,
+        model_version,
+        ids["subject_id"].to_numpy(),
+        ids["hadm_id"].to_numpy(),
+        posterior.to_numpy(),
+        ids["class_assignment"].to_numpy(),
+        metadata={"posterior_columns": list(posterior.columns),
+                  **(metadata or {})},
+    )
+
+
+def open_assignment_store(store_dir, model_version=None):
+    """
+    Opens one model version of a store. The arrays are memory-mapped, so
+    only the pages that are accessed are read from disk.
+
+    Parameters:
+    - store_dir (str): Store directory.
+    - model_version (str): Model version to open. Default is the most
+      recently written one.
+
+    Returns:
+    - dict: 'posterior' (float32 memmap, rows x classes),
+      'class_assignment' (int8 memmap), 'ids' (int32 memmap of
+      subject_id and hadm_id per row), 'key_index'/'key_order' and
+      'hadm_index'/'hadm_order' (sorted keys and their row positions), and
+      'metadata'.
+    """
+    if model_version is None:
+        versions = list_model_versions(store_dir)
+        if not versions:
+            raise FileNotFoundError(f"No model versions in '{store_dir}'")
+        model_version = versions[-1]
+    path = _version_dir(store_dir, model_version)
+    if not os.path.exists(os.path.join(path, METADATA_FILE)):
+        raise FileNotFoundError(
+            f"Model version '{model_version}' not found in '{store_dir}'"
+        )
+
+    with open(os.path.join(path, METADATA_FILE)) as f:
+        metadata = json.load(f)
+
+    def load(name):
+        return np.load(os.path.join(path, name), mmap_mode="r")
+
+    return {
+        "posterior": load(POSTERIOR_FILE),
+        "class_assignment": load(ASSIGNMENT_FILE),
+        "ids": load(IDS_FILE),
+        "key_index": load(KEY_INDEX_FILE),
+        "key_order": load(KEY_ORDER_FILE),
+        "hadm_index": load(HADM_INDEX_FILE),
+        "hadm_order": load(HADM_ORDER_FILE),
+        "metadata": metadata,
+    }
+
+
+def _range_positions(index, order, lower, upper):
+    """
+    Row positions whose key lies in [lower, upper) for every query, found
+    by binary search in the sorted index.
+
+    Parameters:
+    - index (np.ndarray): Sorted keys.
+    - order (np.ndarray): Row position of each sorted key.
+    - lower (np.ndarray): Inclusive lower bounds.
+    - upper (np.ndarray): Exclusive upper bounds.
+
+    Returns:
+    - np.ndarray: Row positions of all matches.
+    """
+    start = np.searchsorted(index, lower, side="left")
+    stop = np.searchsorted(index, upper, side="left")
+    counts = stop - start
+    # Positions start[q], start[q] + 1, ..., stop[q] - 1 for every query q
+    offsets = np.arange(counts.sum()) - np.repeat(
+        np.cumsum(counts) - counts, counts
+    )
+    return np.asarray(order[np.repeat(start, counts) + offsets])
+
+
+def lookup_assignments(store, subject_id=None, hadm_id=None):
+    """
+    Looks up the class assignment and posterior of one or many patients.
+
+    Pass subject_id alone for all admissions of the patients, hadm_id
+    alone for specific admissions, or both (same length) for exact
+    (subject_id, hadm_id) pairs. Each lookup is a binary search in the
+    sorted index, so only the matching rows of the memory-mapped arrays
+    are read.
+
+    Parameters:
+    - store (dict): Output of open_assignment_store.
+    - subject_id (int or array-like): subject_id(s) to look up.
+    - hadm_id (int or array-like): hadm_id(s) to look up.
+
+    Returns:
+    - pd.DataFrame: One row per match, in store order, with 'subject_id',
+      'hadm_id', 'class_assignment' (0 for no class) and one posterior
+      column per class ('V1', 'V2', ... as in poLCA's posterior). Queries
+      without a match are left out.
+    """
+    import pandas as pd
+
+    if subject_id is None and hadm_id is None:
+        raise ValueError("Pass subject_id, hadm_id, or both")
+
+    if subject_id is None:
+        hadm = np.atleast_1d(np.asarray(hadm_id, dtype=np.int64))
+        positions = _range_positions(
+            store["hadm_index"], store["hadm_order"], hadm, hadm + 1
+        )
+    else:
+        subject = np.atleast_1d(np.asarray(subject_id, dtype=np.int64))
+        if hadm_id is None:
+            lower = subject << KEY_SHIFT
+            upper = (subject + 1) << KEY_SHIFT
+        else:
+            hadm = np.atleast_1d(np.asarray(hadm_id, dtype=np.int64))
+            if len(hadm) != len(subject):
+                raise ValueError(
+                    "subject_id and hadm_id must have the same length"
+                )
+            lower = _pack_keys(subject, hadm)
+            upper = lower + 1
+        positions = _range_positions(
+            store["key_index"], store["key_order"], lower, upper
+        )
+
+    # Read the memory-mapped rows in file order
+    positions = np.unique(positions)
+    ids = np.asarray(store["ids"][positions])
+    posterior = np.asarray(store["posterior"][positions])
+
+    result = pd.DataFrame({
+        "subject_id": ids[:, 0],
+        "hadm_id": ids[:, 1],
+        "class_assignment": np.asarray(store["class_assignment"][positions]),
+    })
+    for k in range(posterior.shape[1]):
+        result[f"V{k + 1}"] = posterior[:, k]
+    return result
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from .data_preprocessing import (
     get_morbidity_columns_and_distribution,
@@ -6,6 +7,8 @@ from .data_preprocessing import (
 LCA_ADD_ONE = 1
 CLASS_ASSIGNMENT_INDEX = -1
 MAX_MORBIDITY_NUM = 8
+# Columns that identify an admission in df and in a posterior DataFrame
+ADMISSION_KEYS = ["subject_id", "hadm_id"]
 
 
 def reassign_classes(df, df_prob, num_classes=6):
@@ -120,7 +123,15 @@ def reassign_class_assignment(df):
     return df
 
 
-def process_morbidity_data(df, classes_map=None):
+def _posterior_class(label):
+    """
+    Class number of a label from reassign_classes ("3") or of a poLCA
+    predclass (3).
+    """
+    return int(label) if str(label).isdigit() else label
+
+
+def process_morbidity_data(df, classes_map=None, return_mapping=False):
     """
     Processes morbidity data by adjusting indices, calculating percentages, and
     reassigning class assignments.
@@ -128,23 +139,271 @@ def process_morbidity_data(df, classes_map=None):
     Parameters:
     - df (pd.DataFrame): DataFrame with class
     assignments and morbidity columns.
+    - classes_map (dict): Renumbering of the sequential classes.
+    - return_mapping (bool): Also return the final subgroup of each
+    posterior class, for summarize_subgroups. Default is False.
 
     Returns:
     - pd.DataFrame: Fully processed DataFrame.
+    - dict: Posterior class number (the n of column Vn) -> final
+    subgroup, only with return_mapping=True.
     """
     df = adjust_elixhauser_index(df)
     df = calculate_percentage_within_subgroup(df)
+    original_classes = sorted(df["class_assignment"].unique())
     df = reassign_class_assignment(df)
+    mapping = {
+        _posterior_class(original): new
+        for new, original in enumerate(original_classes, start=1)
+    }
 
     # Final sorting for easier viewing
     if classes_map is not None:
         df["class_assignment"] = df["class_assignment"].map(classes_map)
+        mapping = {
+            original: classes_map[new]
+            for original, new in mapping.items() if new in classes_map
+        }
     df = df.sort_values(by="count_morbidity", ascending=True)
+    if return_mapping:
+        return df, mapping
     return df
 
 
+def class_membership_matrix(
+    df, posterior=None, subgroup_column="class_assignment", class_mapping=None
+):
+    """
+    Builds the n x k matrix of class memberships used by the summaries
+    below: the posterior probabilities when they are given, otherwise the
+    one-hot encoding of the hard labels in subgroup_column.
+
+    Parameters:
+    - df (pd.DataFrame): Data the memberships belong to.
+    - posterior (pd.DataFrame or np.ndarray): Posterior probabilities, one
+      column per class (V1..Vk as written by poLCA). A DataFrame with
+      'subject_id' and 'hadm_id' columns is matched to df on them, so df
+      may come from a merge; otherwise it is aligned on df's index, which
+      a merge resets. An array must have one row per row of df. Default
+      uses the hard labels.
+    - subgroup_column (str): Column with the hard labels. Default is
+      "class_assignment".
+    - class_mapping (dict): Posterior class number -> subgroup, as
+      returned by process_morbidity_data(..., return_mapping=True). Only
+      these classes are kept, each row is renormalised over them, and the
+      columns are labelled and ordered by subgroup. Default keeps every
+      class under its own number.
+
+    When df also has the hard labels, each row's hard subgroup must be one
+    of its most probable subgroups, which catches posterior rows that do
+    not belong to df's rows or a missing class_mapping.
+
+    Returns:
+    - np.ndarray: Memberships (float64), with all-zero rows for rows
+      without a label.
+    - pd.Index: Class of each column, named subgroup_column.
+    """
+    if posterior is None:
+        codes, classes = pd.factorize(df[subgroup_column], sort=True)
+        weights = np.zeros((len(df), len(classes)))
+        labelled = codes >= 0
+        weights[np.flatnonzero(labelled), codes[labelled]] = 1.0
+        return weights, pd.Index(classes, name=subgroup_column)
+
+    keyed = False
+    if isinstance(posterior, pd.DataFrame):
+        keyed = all(key in df and key in posterior for key in ADMISSION_KEYS)
+        if keyed:
+            try:
+                posterior = df[ADMISSION_KEYS].merge(
+                    posterior, on=ADMISSION_KEYS, how="left",
+                    validate="many_to_one",
+                ).drop(columns=ADMISSION_KEYS)
+            except pd.errors.MergeError:
+                raise ValueError(
+                    "posterior has several rows for the same subject_id "
+                    "and hadm_id"
+                ) from None
+            if posterior.isna().any(axis=None):
+                raise ValueError(
+                    "posterior rows do not align with df: some admissions "
+                    "of df are not in posterior"
+                )
+        elif not df.index.isin(posterior.index).all():
+            raise ValueError(
+                "posterior rows do not align with df: df's index has rows "
+                "that posterior does not have. Keep df's index, or add "
+                "'subject_id' and 'hadm_id' columns to posterior"
+            )
+        else:
+            posterior = posterior.loc[df.index]
+        numbers = [_posterior_class(str(col).lstrip("V"))
+                   for col in posterior.columns]
+    else:
+        numbers = list(range(1, np.shape(posterior)[1] + 1))
+    weights = np.asarray(posterior, dtype=np.float64)
+    if weights.shape[0] != len(df):
+        raise ValueError("posterior must have one row per row of df")
+    if np.isnan(weights).any():
+        raise ValueError("posterior contains missing values")
+
+    mapped = class_mapping is not None
+    if class_mapping is None:
+        class_mapping = {number: number for number in numbers}
+    missing = set(class_mapping) - set(numbers)
+    if missing:
+        raise ValueError(f"posterior has no columns for classes {missing}")
+    kept = sorted(class_mapping, key=lambda number: class_mapping[number])
+    weights = weights[:, [numbers.index(number) for number in kept]]
+    # Probability of each kept class given that the row is in one of them
+    row_sum = weights.sum(axis=1, keepdims=True)
+    weights = np.divide(weights, row_sum, out=np.zeros_like(weights),
+                        where=row_sum > 0)
+    classes = pd.Index([class_mapping[number] for number in kept],
+                       name=subgroup_column)
+
+    if subgroup_column in df:
+        labels = df[subgroup_column].to_numpy()
+        column = classes.get_indexer(labels)
+        labelled = pd.notna(labels)
+        rows = np.flatnonzero(labelled)
+        if (column[labelled] < 0).any() or (
+            weights[rows, column[labelled]] < weights[rows].max(axis=1)
+        ).any():
+            if mapped and not keyed:
+                # The classes are matched, so the rows must be wrong
+                raise ValueError(
+                    f"posterior rows do not align with df: the most "
+                    f"probable subgroups disagree with '{subgroup_column}'. "
+                    f"If df comes from a merge, which resets the index, "
+                    f"add 'subject_id' and 'hadm_id' columns to posterior"
+                )
+            raise ValueError(
+                f"posterior does not match the subgroups in "
+                f"'{subgroup_column}': pass the class_mapping returned by "
+                f"process_morbidity_data(..., return_mapping=True)"
+                + ("" if keyed else
+                   ", and check that the posterior rows align with df")
+            )
+    return weights, classes
+
+
+def _morbidity_sort_key(value):
+    text = str(value).lstrip(">=")
+    try:
+        return (0, float(text), str(value))
+    except ValueError:
+        return (1, 0.0, str(value))
+
+
+def summarize_subgroups(
+    df,
+    posterior=None,
+    condition_columns=(),
+    score_columns=(),
+    morbidity_column=None,
+    subgroup_column="class_assignment",
+    class_mapping=None,
+):
+    """
+    Computes subgroup prevalences, multimorbidity count distributions and
+    mean scores (e.g. SOFA, OASIS, length of stay) for every column and
+    class at once.
+
+    Every statistic is a weighted mean over the rows, so all of them come
+    from one matrix product W^T X, where W holds the class memberships
+    (see class_membership_matrix) and X the columns side by side. With the
+    posterior probabilities as W, each patient counts towards every class
+    in proportion to its probability, which keeps the uncertainty of the
+    assignment. With the hard labels, W is one-hot and the results equal
+    the groupby means of calculate_prevalence and
+    calculate_percentage_within_subgroup.
+
+    Parameters:
+    - df (pd.DataFrame): Data with the columns to summarise.
+    - posterior (pd.DataFrame or np.ndarray): Posterior probabilities, as
+      in class_membership_matrix. Default uses the hard labels.
+    - condition_columns (list): 0/1 condition columns, e.g. the Elixhauser
+      indices after adjust_elixhauser_index, or "sepsis".
+    - score_columns (list): Numeric columns to average, e.g. ["sofa",
+      "oasis", "los_icu_days"].
+    - morbidity_column (str): Column with the multimorbidity count, e.g.
+      "count_morbidity". Default skips the distribution.
+    - subgroup_column (str): Column with the hard labels. Default is
+      "class_assignment".
+    - class_mapping (dict): Posterior class number -> subgroup, as in
+      class_membership_matrix.
+
+    Missing values are left out of each column's mean separately, as
+    groupby does.
+
+    Returns:
+    - dict: 'size' (expected number of patients per class), 'prevalence'
+      (percent with each condition), 'morbidity_distribution' (percent
+      with each multimorbidity count) and 'means' (mean of each score).
+      The tables have one row per class.
+    """
+    weights, classes = class_membership_matrix(
+        df, posterior, subgroup_column, class_mapping
+    )
+    condition_columns = list(condition_columns)
+    score_columns = list(score_columns)
+
+    columns = condition_columns + score_columns
+    categories = []
+    if morbidity_column is not None:
+        counts = df[morbidity_column]
+        categories = sorted(counts.dropna().unique(), key=_morbidity_sort_key)
+        codes = pd.Categorical(counts, categories=categories).codes
+
+    # Columns with missing values also need their number of observed rows
+    # per class; the others are divided by the class size
+    missing = {col: df[col].isna().to_numpy() for col in columns}
+    partial = [col for col in columns if missing[col].any()]
+    m, p = len(columns), len(partial)
+
+    # All columns side by side, filled in place. Column-major, so each
+    # column is one contiguous write
+    x = np.zeros((len(df), m + p + len(categories)), order="F")
+    for j, col in enumerate(columns):
+        x[:, j] = df[col].to_numpy(dtype=np.float64)
+    for j, col in enumerate(partial):
+        x[missing[col], columns.index(col)] = 0.0
+        x[:, m + j] = ~missing[col]
+    if categories:
+        present = codes >= 0
+        x[np.flatnonzero(present), m + p + codes[present]] = 1.0
+
+    # One product for every statistic of every class
+    totals = weights.T @ x
+    size = pd.Series(weights.sum(axis=0), index=classes, name="size")
+    observed = np.repeat(size.to_numpy()[:, None], m, axis=1)
+    for j, col in enumerate(partial):
+        observed[:, columns.index(col)] = totals[:, m + j]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = totals[:, :m] / observed
+        distribution = totals[:, m + p:] / size.to_numpy()[:, None] * 100
+
+    return {
+        "size": size,
+        "prevalence": pd.DataFrame(
+            means[:, :len(condition_columns)] * 100,
+            index=classes, columns=condition_columns,
+        ),
+        "morbidity_distribution": pd.DataFrame(
+            distribution, index=classes,
+            columns=pd.Index(categories, name=morbidity_column),
+        ),
+        "means": pd.DataFrame(
+            means[:, len(condition_columns):],
+            index=classes, columns=score_columns,
+        ),
+    }
+
+
 def calculate_prevalence(
-    df, condition_columns, subgroup_column="class_assignment"
+    df, condition_columns, subgroup_column="class_assignment", posterior=None,
+    class_mapping=None,
 ):
     """
     Calculate percentages for conditions by subgroups.
@@ -155,13 +414,20 @@ def calculate_prevalence(
     - condition_columns (list): List of condition columns
     to calculate percentages for.
     - subgroup_column (str): Column name for subgroups.
+    - posterior (pd.DataFrame or np.ndarray): Posterior probabilities
+    to weight the patients by instead of the hard subgroups (see
+    summarize_subgroups). Default uses subgroup_column.
+    - class_mapping (dict): Posterior class number -> subgroup, as in
+    summarize_subgroups.
 
     Returns:
     - pd.DataFrame: DataFrame with prevalence percentages
     for each condition by subgroup.
     """
-    percentages = {
-        condition: df.groupby(subgroup_column)[condition].mean() * 100
-        for condition in condition_columns
-    }
-    return pd.DataFrame(percentages)
+    return summarize_subgroups(
+        df,
+        posterior=posterior,
+        condition_columns=condition_columns,
+        subgroup_column=subgroup_column,
+        class_mapping=class_mapping,
+    )["prevalence"]
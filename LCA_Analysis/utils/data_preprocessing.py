@@ -1,9 +1,12 @@
-import pandas as pd
-
 LCA_ADD_ONE = 1
 CLASS_ASSIGNMENT_INDEX = -1
 MAX_MORBIDITY_NUM = 8
 
+# Age buckets used across the SQL scripts, the stratified fits and the
+# k-means analysis
+AGE_BUCKET_BINS = [16, 25, 45, 65, 85, 96]
+AGE_BUCKET_LABELS = ["16-24", "25-44", "45-64", "65-84", "85-95"]
+
 
 def get_morbidity_columns_and_distribution(
     df, exclude_columns=None, display_distribution=True
@@ -57,6 +60,27 @@ def get_morbidity_columns_and_distribution(
     return target_columns, morbidity_distribution
 
 
+def assign_age_bucket(ages):
+    """
+    Maps ages to the '16-24' ... '85-95' buckets used in the SQL scripts.
+
+    Parameters:
+    - ages (array-like): Ages in whole years.
+
+    Returns:
+    - pd.Categorical: Age bucket per row, NaN outside 16-95.
+    """
+    import numpy as np
+    import pandas as pd
+
+    return pd.cut(
+        np.asarray(ages),
+        bins=AGE_BUCKET_BINS,
+        labels=AGE_BUCKET_LABELS,
+        right=False,
+    )
+
+
 def preprocess_lca_data(
     input_path="data/raw_data/poLCA_35128.csv",
     output_path="data/processed_data/LCA_prep_data.csv",
@@ -79,6 +103,10 @@ def preprocess_lca_data(
     Returns:
     - DataFrame: The processed DataFrame.
     """
+    # pandas is imported here rather than at module level so that
+    # source_python() and preprocessing-only workers start quickly
+    import pandas as pd
+
     df = pd.read_csv(input_path)
 
     # Modify admission type to make all non-elective
@@ -1,9 +1,5 @@
-from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import cross_val_predict, StratifiedKFold
-from sklearn.metrics import roc_curve, auc
-
-
-def calculate_auc_for_class(df, class_label, feature_columns, cv_splits=10):
+def calculate_auc_for_class(df, class_label, feature_columns, cv_splits=10,
+                            features=None):
     """
     Calculates cross-validated AUC-ROC for a specific class vs. all other
     classes.
@@ -14,16 +10,39 @@ def calculate_auc_for_class(df, class_label, feature_columns, cv_splits=10):
     - feature_columns (list): List of feature columns for the logistic
       regression model.
     - cv_splits (int): Number of splits for cross-validation. Default is 10.
+    - features (scipy.sparse matrix): Extra sparse features aligned with the
+      rows of df, e.g. the ICD-9 code matrix of
+      sql_queries.diagnosis_features.build_diagnosis_matrix. They are used
+      next to feature_columns without being densified. Default is None.
 
     Returns:
     - tuple: (fpr, tpr, auc_score) for the cross-validated ROC curve of the
       specified class.
     """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.model_selection import cross_val_predict, StratifiedKFold
+    from sklearn.metrics import roc_curve, auc
+
     # Create a binary target for the class vs. all others
     df["dichotomized_class"] = df["class_assignment"].apply(
         lambda x: 1 if x == class_label else 0
     )
-    X = df[feature_columns]
+    if features is None:
+        X = df[feature_columns]
+    else:
+        from scipy import sparse
+
+        if features.shape[0] != len(df):
+            raise ValueError(
+                "df and features must have the same number of rows"
+            )
+        # Stack the DataFrame columns next to the sparse features without
+        # densifying them
+        X = sparse.hstack(
+            [sparse.csr_matrix(df[feature_columns].to_numpy(dtype=float)),
+             features],
+            format="csr",
+        )
     y = df["dichotomized_class"]
 
     log_reg = LogisticRegression(max_iter=1000)
@@ -0,0 +1,403 @@
+import numpy as np
+
+# Floor for class-conditional probabilities so empty cells do not produce
+# log(0) during EM
+MIN_PROBABILITY = 1e-10
+
+
+def encode_categories(df, columns):
+    """
+    Encodes categorical manifest variables as 0-based integer codes.
+
+    Parameters:
+    - df (pd.DataFrame): DataFrame containing the manifest variables.
+    - columns (list): Columns to encode. Values are treated as unordered
+      categories, as poLCA does with factors.
+
+    Returns:
+    - tuple: (codes, levels) where codes is an int32 array of shape
+      (n_rows, n_columns) with -1 for missing values, and levels is a list
+      with the sorted category values of each column.
+    """
+    import pandas as pd
+
+    codes = np.empty((len(df), len(columns)), dtype=np.int32)
+    levels = []
+    for j, column in enumerate(columns):
+        categorical = pd.Categorical(df[column])
+        codes[:, j] = categorical.codes
+        levels.append(list(categorical.categories))
+    return codes, levels
+
+
+def _one_hot(codes, n_levels):
+    """
+    Builds a sparse one-hot matrix of all manifest variables side by side.
+
+    Parameters:
+    - codes (np.ndarray): 0-based codes, shape (n_rows, n_columns).
+    - n_levels (list): Number of categories per column.
+
+    Returns:
+    - scipy.sparse.csr_matrix: Shape (n_rows, sum(n_levels)).
+    """
+    from scipy import sparse
+
+    n_rows, n_columns = codes.shape
+    offsets = np.concatenate([[0], np.cumsum(n_levels)[:-1]])
+    column_index = (codes + offsets).ravel()
+    row_index = np.repeat(np.arange(n_rows), n_columns)
+    data = np.ones(len(column_index))
+    return sparse.csr_matrix(
+        (data, (row_index, column_index)),
+        shape=(n_rows, int(np.sum(n_levels))),
+    )
+
+
+def _random_probs(rng, n_classes, n_levels):
+    """
+    Draws random starting class-conditional probabilities.
+
+    Parameters:
+    - rng (np.random.Generator): Random generator.
+    - n_classes (int): Number of latent classes.
+    - n_levels (list): Number of categories per manifest variable.
+
+    Returns:
+    - list: One (n_classes, n_levels[j]) array per manifest variable, rows
+      summing to one.
+    """
+    probs = []
+    for n in n_levels:
+        p = rng.uniform(size=(n_classes, n))
+        probs.append(p / p.sum(axis=1, keepdims=True))
+    return probs
+
+
+def _em(one_hot, n_levels, probs, class_prior, max_iter, tol):
+    """
+    Runs EM from the given starting values.
+
+    Parameters:
+    - one_hot (scipy.sparse.csr_matrix): Output of _one_hot.
+    - n_levels (list): Number of categories per manifest variable.
+    - probs (list): Starting class-conditional probabilities.
+    - class_prior (np.ndarray): Starting class shares.
+    - max_iter (int): Maximum number of iterations.
+    - tol (float): Stop when the log-likelihood improves by less than this.
+
+    Returns:
+    - dict: 'probs', 'P', 'posterior', 'llik' and 'numiter'.
+    """
+    split_points = np.cumsum(n_levels)[:-1]
+    log_probs = np.log(np.maximum(np.hstack(probs), MIN_PROBABILITY))
+    log_prior = np.log(np.maximum(class_prior, MIN_PROBABILITY))
+
+    llik = -np.inf
+    numiter = 0
+    for numiter in range(1, max_iter + 1):
+        # E-step: log p(x_i, class r) for every row and class at once
+        joint = one_hot @ log_probs.T + log_prior
+        row_max = joint.max(axis=1, keepdims=True)
+        likelihood = np.exp(joint - row_max)
+        row_sum = likelihood.sum(axis=1, keepdims=True)
+        posterior = likelihood / row_sum
+        new_llik = float(np.sum(np.log(row_sum) + row_max))
+
+        # M-step: expected category counts per class
+        class_weight = posterior.sum(axis=0)
+        counts = np.asarray((one_hot.T @ posterior).T)
+        blocks = np.split(counts, split_points, axis=1)
+        probs = [
+            block / np.maximum(block.sum(axis=1, keepdims=True),
+                               MIN_PROBABILITY)
+            for block in blocks
+        ]
+        log_probs = np.log(np.maximum(np.hstack(probs), MIN_PROBABILITY))
+        class_prior = class_weight / class_weight.sum()
+        log_prior = np.log(np.maximum(class_prior, MIN_PROBABILITY))
+
+        converged = new_llik - llik < tol
+        llik = new_llik
+        if converged:
+            break
+
+    return {
+        "probs": probs,
+        "P": class_prior,
+        "posterior": posterior,
+        "llik": llik,
+        "numiter": numiter,
+    }
+
+
+def fit_lca(codes, n_classes, max_iter=7000, tol=1e-5, n_rep=5, seed=1,
+            n_levels=None, probs_start=None, P_start=None):
+    """
+    Fits a latent class model with EM, the same model poLCA fits with
+    `poLCA(cbind(...) ~ 1, nclass = n_classes)`.
+
+    Rows with a missing value in any manifest variable are dropped, as with
+    poLCA's na.rm = TRUE.
+
+    Parameters:
+    - codes (np.ndarray): 0-based category codes from encode_categories,
+      shape (n_rows, n_columns), -1 for missing.
+    - n_classes (int): Number of latent classes.
+    - max_iter (int): Maximum EM iterations per start. Default is 7000.
+    - tol (float): Log-likelihood convergence tolerance. Default is 1e-5.
+    - n_rep (int): Number of random starts; the best log-likelihood is kept.
+      Ignored when probs_start is given. Default is 5.
+    - seed (int): Random seed. Default is 1.
+    - n_levels (list): Number of categories per column. Default is inferred
+      from codes; pass it when fitting a subset of rows so every subset uses
+      the same category layout.
+    - probs_start (list): Starting class-conditional probabilities, e.g.
+      the 'probs' of an earlier fit or of split_lca_class, like poLCA's
+      probs.start. The model is then fitted once from these values instead
+      of from n_rep random starts. Default is random starts.
+    - P_start (np.ndarray): Starting class shares used with probs_start.
+      Default is equal shares.
+
+    Returns:
+    - dict: poLCA-style results: 'probs' (list of class-conditional
+      probability arrays), 'P' (class shares), 'posterior' (rows x classes,
+      NaN for dropped rows), 'predclass' (1-based class, 0 for dropped rows),
+      'llik', 'aic', 'bic', 'npar', 'numiter' (iterations of the kept
+      start), 'total_iter' (iterations of all starts), 'n_levels' and
+      'nclass'.
+    """
+
+    codes = np.asarray(codes)
+    if probs_start is not None and len(probs_start) != codes.shape[1]:
+        raise ValueError("probs_start needs one array per manifest variable")
+    if n_levels is None:
+        n_levels = list(codes.max(axis=0) + 1)
+    n_levels = [int(n) for n in n_levels]
+
+    complete = (codes >= 0).all(axis=1)
+    one_hot = _one_hot(codes[complete], n_levels)
+    n_obs = int(complete.sum())
+
+    if probs_start is not None:
+        n_rep = 1
+    rng = np.random.default_rng(seed)
+    best = None
+    total_iter = 0
+    for rep in range(max(n_rep, 1)):
+        class_prior = np.full(n_classes, 1.0 / n_classes)
+        if probs_start is not None:
+            probs = [np.asarray(p, dtype=np.float64) for p in probs_start]
+            if P_start is not None:
+                class_prior = np.asarray(P_start, dtype=np.float64)
+        else:
+            probs = _random_probs(rng, n_classes, n_levels)
+        fit = _em(one_hot, n_levels, probs, class_prior, max_iter, tol)
+        total_iter += fit["numiter"]
+        if best is None or fit["llik"] > best["llik"]:
+            best = fit
+
+    npar = n_classes * sum(n - 1 for n in n_levels) + (n_classes - 1)
+    posterior = np.full((len(codes), n_classes), np.nan)
+    posterior[complete] = best["posterior"]
+    predclass = np.zeros(len(codes), dtype=np.int32)
+    predclass[complete] = best["posterior"].argmax(axis=1) + 1
+
+    return {
+        "probs": best["probs"],
+        "P": best["P"],
+        "posterior": posterior,
+        "predclass": predclass,
+        "llik": best["llik"],
+        "aic": -2 * best["llik"] + 2 * npar,
+        "bic": -2 * best["llik"] + npar * np.log(n_obs),
+        "npar": npar,
+        "numiter": best["numiter"],
+        "total_iter": total_iter,
+        "n_levels": n_levels,
+        "nclass": n_classes,
+    }
+
+
+def weakest_lca_class(model):
+    """
+    Finds the class whose members have the lowest average posterior
+    probability, i.e. the least clearly separated class, as
+    weakest_lca_class in R/LCA_analysis.R.
+
+    Parameters:
+    - model (dict): Output of fit_lca.
+
+    Returns:
+    - int: 1-based class number.
+    """
+    complete = model["predclass"] > 0
+    certainty = np.full(model["nclass"], np.inf)
+    classes = model["predclass"][complete] - 1
+    totals = np.bincount(
+        classes,
+        weights=model["posterior"][complete].max(axis=1),
+        minlength=model["nclass"],
+    )
+    sizes = np.bincount(classes, minlength=model["nclass"])
+    # Empty classes have nothing to split
+    filled = sizes > 0
+    certainty[filled] = totals[filled] / sizes[filled]
+    return int(np.argmin(certainty)) + 1
+
+
+def split_lca_class(model, lca_class=None, jitter=0.05, seed=1):
+    """
+    Builds starting values for a model with one more class by replacing
+    one class with two slightly perturbed copies of its response
+    probabilities, as split_lca_class in R/LCA_analysis.R.
+
+    Parameters:
+    - model (dict): Output of fit_lca with k classes.
+    - lca_class (int): 1-based class to split. Default is the weakest
+      class (see weakest_lca_class).
+    - jitter (float): Relative perturbation applied in opposite directions
+      to the two copies. Default is 0.05.
+    - seed (int): Random seed. Default is 1.
+
+    Returns:
+    - tuple: (probs_start, P_start) for a (k+1)-class fit_lca; the split
+      class's share is divided between its two copies.
+    """
+    if lca_class is None:
+        lca_class = weakest_lca_class(model)
+    row = lca_class - 1
+    rng = np.random.default_rng(seed)
+
+    probs_start = []
+    for probs in model["probs"]:
+        perturbation = rng.uniform(-jitter, jitter, size=probs.shape[1])
+        first = np.maximum(probs[row] * (1 + perturbation), 1e-6)
+        second = np.maximum(probs[row] * (1 - perturbation), 1e-6)
+        split = np.vstack([probs, second / second.sum()])
+        split[row] = first / first.sum()
+        probs_start.append(split)
+
+    P_start = np.append(model["P"], model["P"][row] / 2)
+    P_start[row] /= 2
+    return probs_start, P_start
+
+
+def _start_matches(probs, n_levels):
+    return len(probs) == len(n_levels) and all(
+        np.shape(p)[1] == n for p, n in zip(probs, n_levels)
+    )
+
+
+def find_best_lca_model(codes, class_range, max_iter=7000, tol=1e-5,
+                        n_rep=5, seed=1, n_levels=None, warm_start=False,
+                        prior_model=None, compare_cold=False):
+    """
+    Fits fit_lca for every number of classes in class_range and keeps the
+    models with the lowest AIC, BIC and AIC + BIC, as find_best_lca_model
+    in R/LCA_analysis.R.
+
+    With warm_start, a (k+1)-class model is started from the k-class
+    model with its weakest class split in two (see split_lca_class), and
+    a model with as many classes as prior_model is started from
+    prior_model. Warm-started models are fitted once from their starting
+    values instead of from n_rep random starts. With compare_cold, they
+    are also fitted from n_rep random starts on the same data, and the
+    fit with the higher log-likelihood is kept.
+
+    Parameters:
+    - codes (np.ndarray): 0-based category codes from encode_categories.
+    - class_range (iterable): Numbers of classes to fit, e.g. range(6, 9).
+    - max_iter (int): Maximum EM iterations per start. Default is 7000.
+    - tol (float): Log-likelihood convergence tolerance. Default is 1e-5.
+    - n_rep (int): Random starts of cold fits. Default is 5.
+    - seed (int): Random seed. Default is 1.
+    - n_levels (list): Number of categories per column, as in fit_lca.
+    - warm_start (bool): Seed k + 1 classes from the k-class model.
+      Default is False.
+    - prior_model (dict): A fit_lca result from earlier data, used to seed
+      the model with the same number of classes (and, with warm_start,
+      one class more). Ignored with a warning if its categories do not
+      match codes. Default is None.
+    - compare_cold (bool): Also fit every warm-started model from n_rep
+      random starts, to measure the iterations saved and keep the better
+      of the two fits. Default is False.
+
+    Returns:
+    - dict: 'best_model_bic', 'best_model_aic',
+      'best_model_aic_bic_combined', 'models' (number of classes -> model)
+      and 'iterations' (pd.DataFrame with one row per fit: nclass, start
+      ('random', 'split' or 'prior'), kept (start of the kept model,
+      'random' when the cold fit was better), numiter (iterations of all
+      starts of the fit), cold_numiter (iterations of all n_rep random
+      starts on the same data; NaN for warm starts without compare_cold)
+      and iterations_saved).
+    """
+    import warnings
+
+    import pandas as pd
+
+    codes = np.asarray(codes)
+    if n_levels is None:
+        n_levels = list(codes.max(axis=0) + 1)
+    n_levels = [int(n) for n in n_levels]
+    if prior_model is not None \
+            and not _start_matches(prior_model["probs"], n_levels):
+        warnings.warn("prior_model does not match the categories in codes, "
+                      "fitting from random starts")
+        prior_model = None
+
+    options = dict(max_iter=max_iter, tol=tol, seed=seed, n_levels=n_levels)
+    models = {}
+    rows = []
+    for n_classes in class_range:
+        # Starting values: the prior model with the same number of
+        # classes, then a split of a model with one class less, otherwise
+        # random starts
+        previous = models.get(n_classes - 1)
+        if previous is None and prior_model is not None \
+                and prior_model["nclass"] == n_classes - 1:
+            previous = prior_model
+        start, probs_start, P_start = "random", None, None
+        if prior_model is not None and prior_model["nclass"] == n_classes:
+            start = "prior"
+            probs_start, P_start = prior_model["probs"], prior_model["P"]
+        elif warm_start and previous is not None:
+            start = "split"
+            probs_start, P_start = split_lca_class(previous, seed=seed)
+
+        model = fit_lca(codes, n_classes, n_rep=n_rep,
+                        probs_start=probs_start, P_start=P_start, **options)
+        numiter = model["total_iter"]
+        kept = start
+        cold_iter = np.nan
+        if probs_start is None:
+            cold_iter = numiter
+        elif compare_cold:
+            cold = fit_lca(codes, n_classes, n_rep=n_rep, **options)
+            cold_iter = cold["total_iter"]
+            # The warm start replaces n_rep random starts, so it is only
+            # kept when it finds at least as good a solution
+            if cold["llik"] > model["llik"]:
+                model = cold
+                kept = "random"
+        models[n_classes] = model
+        rows.append({
+            "nclass": n_classes,
+            "start": start,
+            "kept": kept,
+            "numiter": numiter,
+            "cold_numiter": cold_iter,
+            "iterations_saved": cold_iter - numiter,
+        })
+
+    fitted = list(models.values())
+    return {
+        "best_model_bic": min(fitted, key=lambda m: m["bic"]),
+        "best_model_aic": min(fitted, key=lambda m: m["aic"]),
+        "best_model_aic_bic_combined": min(
+            fitted, key=lambda m: m["aic"] + m["bic"]
+        ),
+        "models": models,
+        "iterations": pd.DataFrame(rows),
+    }
@@ -0,0 +1,476 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Bytes held per (permutation, row) cell while a chunk of permutations is
+# evaluated: int8 labels, int64 bincount index and float64 weights
+BYTES_PER_PERMUTATION_CELL = 17
+DEFAULT_MEMORY_BUDGET = 256 * 1024 ** 2
+
+# Relative tolerance when comparing permuted and observed statistics, so
+# permutations that reproduce the observed grouping count as extreme
+STATISTIC_TOLERANCE = 1e-9
+
+# Worker-side copy of the data, set by _init_permutation_worker
+_PERMUTATION_DATA = {}
+
+
+def _complete_rows(df, value_column, subgroup_column):
+    """
+    Returns values, 0-based subgroup codes and subgroup labels of the rows
+    where both the value and the subgroup are known.
+
+    Parameters:
+    - df (pd.DataFrame): Data with the value and subgroup columns.
+    - value_column (str): Score or outcome column.
+    - subgroup_column (str): Subgroup column.
+
+    Returns:
+    - tuple: (values as float64, codes as int8, sorted subgroup labels).
+    """
+    import pandas as pd
+
+    data = df[[value_column, subgroup_column]].dropna()
+    codes, labels = pd.factorize(data[subgroup_column], sort=True)
+    if len(labels) > np.iinfo(np.int8).max:
+        raise ValueError("Too many subgroups for int8 labels")
+    return (
+        data[value_column].to_numpy(dtype=np.float64),
+        codes.astype(np.int8),
+        list(labels),
+    )
+
+
+def _rank(values):
+    """
+    Average ranks of the values and the tie correction factor of the
+    Kruskal-Wallis test.
+
+    Parameters:
+    - values (np.ndarray): Values to rank.
+
+    Returns:
+    - tuple: (ranks, tie correction factor).
+    """
+    from scipy.stats import rankdata
+
+    n = len(values)
+    _, ties = np.unique(values, return_counts=True)
+    correction = 1.0 - np.sum(ties ** 3 - ties) / (n ** 3 - n) if n > 1 \
+        else 1.0
+    return rankdata(values), correction
+
+
+def _adjust_pvalues(pvalues, correction):
+    """
+    Adjusts p-values for multiple comparisons.
+
+    Parameters:
+    - pvalues (np.ndarray): Unadjusted p-values.
+    - correction (str): 'holm', 'bonferroni' or None.
+
+    Returns:
+    - np.ndarray: Adjusted p-values.
+    """
+    pvalues = np.asarray(pvalues, dtype=np.float64)
+    m = len(pvalues)
+    if correction is None or m == 0:
+        return pvalues
+    if correction == "bonferroni":
+        return np.minimum(pvalues * m, 1.0)
+    if correction == "holm":
+        order = np.argsort(pvalues)
+        stepped = np.maximum.accumulate(pvalues[order] * (m - np.arange(m)))
+        adjusted = np.empty(m)
+        adjusted[order] = np.minimum(stepped, 1.0)
+        return adjusted
+    raise ValueError(f"Unknown correction '{correction}'")
+
+
+def _group_pairs(labels):
+    """
+    Index pairs (a, b), a < b, of all subgroup pairs.
+
+    Parameters:
+    - labels (list): Subgroup labels.
+
+    Returns:
+    - tuple: (first index array, second index array).
+    """
+    return np.triu_indices(len(labels), k=1)
+
+
+def kruskal_wallis(df, score_column, subgroup_column="class_assignment"):
+    """
+    Kruskal-Wallis H test of whether a score (e.g. SOFA or OASIS) differs
+    between subgroups.
+
+    Ranks are computed once and group rank sums are accumulated with a
+    single bincount, so the test costs one sort of the score column.
+
+    Parameters:
+    - df (pd.DataFrame): Data with the score and subgroup columns.
+    - score_column (str): Continuous or ordinal score column.
+    - subgroup_column (str): Subgroup column. Default is
+      "class_assignment".
+
+    Returns:
+    - dict: 'statistic' (tie-corrected H), 'pvalue', 'dof' (number of
+      subgroups - 1) and 'n' (rows used).
+    """
+    from scipy.stats import chi2
+
+    values, codes, labels = _complete_rows(df, score_column, subgroup_column)
+    n = len(values)
+    ranks, correction = _rank(values)
+    sizes = np.bincount(codes, minlength=len(labels))
+    rank_sums = np.bincount(codes, weights=ranks, minlength=len(labels))
+
+    h = 12.0 / (n * (n + 1)) * np.sum(rank_sums ** 2 / sizes) - 3 * (n + 1)
+    h = h / correction if correction > 0 else 0.0
+    dof = len(labels) - 1
+    return {
+        "statistic": float(h),
+        "pvalue": float(chi2.sf(h, dof)),
+        "dof": dof,
+        "n": n,
+    }
+
+
+def dunn_test(df, score_column, subgroup_column="class_assignment",
+              correction="holm"):
+    """
+    Dunn's pairwise rank test, the usual post-hoc test after a significant
+    Kruskal-Wallis test. All subgroup pairs are compared at once from the
+    mean ranks of the pooled ranking.
+
+    Parameters:
+    - df (pd.DataFrame): Data with the score and subgroup columns.
+    - score_column (str): Continuous or ordinal score column.
+    - subgroup_column (str): Subgroup column. Default is
+      "class_assignment".
+    - correction (str): Multiple comparison correction, 'holm',
+      'bonferroni' or None. Default is 'holm'.
+
+    Returns:
+    - pd.DataFrame: One row per subgroup pair with 'group_a', 'group_b',
+      'mean_rank_difference' (a - b), 'z', 'pvalue' and 'pvalue_adjusted'.
+    """
+    import pandas as pd
+    from scipy.stats import norm
+
+    values, codes, labels = _complete_rows(df, score_column, subgroup_column)
+    n = len(values)
+    ranks, _ = _rank(values)
+    _, ties = np.unique(values, return_counts=True)
+    sizes = np.bincount(codes, minlength=len(labels))
+    mean_ranks = (
+        np.bincount(codes, weights=ranks, minlength=len(labels)) / sizes
+    )
+
+    a, b = _group_pairs(labels)
+    variance = (n * (n + 1) / 12.0 - np.sum(ties ** 3 - ties)
+                / (12.0 * (n - 1)))
+    difference = mean_ranks[a] - mean_ranks[b]
+    z = difference / np.sqrt(variance * (1.0 / sizes[a] + 1.0 / sizes[b]))
+    pvalues = 2 * norm.sf(np.abs(z))
+
+    return pd.DataFrame({
+        "group_a": [labels[i] for i in a],
+        "group_b": [labels[i] for i in b],
+        "mean_rank_difference": difference,
+        "z": z,
+        "pvalue": pvalues,
+        "pvalue_adjusted": _adjust_pvalues(pvalues, correction),
+    })
+
+
+def _group_sums(permuted_codes, values, n_groups):
+    """
+    Sums of the values per subgroup for a batch of label permutations.
+
+    Parameters:
+    - permuted_codes (np.ndarray): (permutations, rows) subgroup codes.
+    - values (np.ndarray): Values per row.
+    - n_groups (int): Number of subgroups.
+
+    Returns:
+    - np.ndarray: (permutations, subgroups) sums.
+    """
+    n_perm = permuted_codes.shape[0]
+    # Offset the codes of permutation p by p * n_groups, so one bincount
+    # fills the sums of every permutation at once
+    index = permuted_codes + (np.arange(n_perm) * n_groups)[:, None]
+    sums = np.bincount(
+        index.ravel(),
+        weights=np.broadcast_to(values, permuted_codes.shape).ravel(),
+        minlength=n_perm * n_groups,
+    )
+    return sums.reshape(n_perm, n_groups)
+
+
+def _init_permutation_worker(values, codes, n_groups):
+    """
+    Worker initializer: keeps the data in the worker, so it is sent once
+    per process instead of once per chunk.
+    """
+    _PERMUTATION_DATA["values"] = values
+    _PERMUTATION_DATA["codes"] = codes
+    _PERMUTATION_DATA["n_groups"] = n_groups
+
+
+def _test_rows(test):
+    """
+    Values, codes and number of groups of one test: every row for the
+    global test (test None), the rows of subgroups a and b, coded 0 and 1,
+    for the pairwise test (a, b).
+    """
+    values = _PERMUTATION_DATA["values"]
+    codes = _PERMUTATION_DATA["codes"]
+    if test is None:
+        return values, codes, _PERMUTATION_DATA["n_groups"]
+    a, b = test
+    in_pair = (codes == a) | (codes == b)
+    return values[in_pair], (codes[in_pair] == b).astype(np.int8), 2
+
+
+def _test_statistic(sums, sizes, test):
+    """
+    Statistic of a batch of group sums: the between-group sum of squares
+    for the global test and the absolute difference in means for a pair.
+    Group sizes and the total are fixed under permutation, so the
+    between-group sum of squares only depends on sum(S_g ** 2 / n_g).
+    """
+    if test is None:
+        return np.sum(sums ** 2 / sizes, axis=-1)
+    means = sums / sizes
+    return np.abs(means[..., 0] - means[..., 1])
+
+
+def _permutation_chunks(test, seed_sequence, n_permutations, memory_budget):
+    """
+    Counts how often permuted statistics reach the observed one, for
+    n_permutations label shuffles evaluated a chunk at a time.
+
+    Labels are only shuffled among the rows of the test, so a pairwise
+    test compares a with b alone and does not depend on the spread of
+    the other subgroups.
+
+    Parameters:
+    - test (tuple): None for the global test, (a, b) subgroup codes for a
+      pairwise test.
+    - seed_sequence (np.random.SeedSequence): Independent seed of this task.
+    - n_permutations (int): Number of permutations of this task.
+    - memory_budget (int): Approximate bytes for one chunk.
+
+    Returns:
+    - tuple: (test, number of permuted statistics >= the observed one).
+    """
+    values, codes, n_groups = _test_rows(test)
+    rng = np.random.default_rng(seed_sequence)
+    sizes = np.bincount(codes, minlength=n_groups)
+    observed = _test_statistic(
+        np.bincount(codes, weights=values, minlength=n_groups), sizes, test
+    )
+    chunk_size = max(1, int(
+        memory_budget // (BYTES_PER_PERMUTATION_CELL * max(len(values), 1))
+    ))
+
+    exceed = 0
+    done = 0
+    while done < n_permutations:
+        batch = min(chunk_size, n_permutations - done)
+        permuted = rng.permuted(np.tile(codes, (batch, 1)), axis=1)
+        statistics = _test_statistic(
+            _group_sums(permuted, values, n_groups), sizes, test
+        )
+        exceed += int(np.sum(
+            statistics >= observed * (1 - STATISTIC_TOLERANCE)
+        ))
+        done += batch
+    return test, exceed
+
+
+def permutation_test(df, value_column, subgroup_column="class_assignment",
+                     n_permutations=10000, rank=None, seed=1, n_workers=None,
+                     memory_budget=DEFAULT_MEMORY_BUDGET,
+                     correction="holm", pairwise=True):
+    """
+    Permutation test of subgroup differences in a continuous score (e.g.
+    SOFA, OASIS) or a binary outcome (e.g. organ dysfunction, sepsis).
+
+    Subgroup labels are shuffled in batches: each chunk is a
+    (permutations x rows) int8 matrix of shuffled labels, and the group
+    sums of every permutation in the chunk come from one bincount. The
+    chunk size follows from memory_budget, and chunks are spread over
+    worker processes with independent random streams.
+
+    The global statistic is the between-group sum of squares of the
+    values (of their ranks when rank=True), reported as
+    (n - 1) * between / total sum of squares. This is the tie-corrected
+    Kruskal-Wallis H for ranks and (n - 1) / n times the Pearson
+    chi-square for a 0/1 outcome. Each pairwise test shuffles the labels
+    among the rows of its two subgroups only and compares the absolute
+    difference in their means (mean ranks, or prevalences).
+
+    Parameters:
+    - df (pd.DataFrame): Data with the value and subgroup columns.
+    - value_column (str): Score or 0/1 outcome column.
+    - subgroup_column (str): Subgroup column. Default is
+      "class_assignment".
+    - n_permutations (int): Number of label permutations per test.
+      Default is 10000.
+    - rank (bool): Test ranks instead of raw values. Default ranks
+      non-binary columns and uses 0/1 outcomes as they are.
+    - seed (int): Random seed. Default is 1.
+    - n_workers (int): Number of worker processes. Default is the number
+      of CPUs; 1 runs in the calling process.
+    - memory_budget (int): Approximate bytes used per worker for one chunk
+      of permutations. Default is 256 MB.
+    - correction (str): Correction of the pairwise p-values, 'holm',
+      'bonferroni' or None. Default is 'holm'.
+    - pairwise (bool): Also run the pairwise tests. Default is True.
+
+    Returns:
+    - dict: 'statistic', 'pvalue' (global), 'pairwise' (DataFrame with
+      'group_a', 'group_b', 'difference' (a - b), 'pvalue' and
+      'pvalue_adjusted', or None with pairwise=False), 'n_permutations',
+      'n' and 'rank'.
+    """
+    import pandas as pd
+
+    values, codes, labels = _complete_rows(df, value_column, subgroup_column)
+    n = len(values)
+    n_groups = len(labels)
+    if rank is None:
+        rank = not np.isin(values, (0.0, 1.0)).all()
+    if rank:
+        values, _ = _rank(values)
+    # Centering leaves every statistic unchanged and keeps the float sums
+    # of large cohorts accurate
+    values = values - values.mean()
+
+    sizes = np.bincount(codes, minlength=n_groups)
+    sums = np.bincount(codes, weights=values, minlength=n_groups)
+    between = np.sum(sums ** 2 / sizes)
+    total = np.sum(values ** 2)
+    a, b = _group_pairs(labels)
+    means = sums / sizes
+
+    tests = [None]
+    if pairwise:
+        tests += list(zip(a.tolist(), b.tolist()))
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = max(1, min(n_workers, n_permutations * len(tests)))
+
+    # Every test's permutations are split into one share per worker, each
+    # with its own random stream
+    shares = np.full(n_workers, n_permutations // n_workers)
+    shares[: n_permutations % n_workers] += 1
+    seeds = np.random.SeedSequence(seed).spawn(len(tests) * n_workers)
+    tasks = [
+        (test, seeds[i * n_workers + j], int(share))
+        for i, test in enumerate(tests)
+        for j, share in enumerate(shares) if share
+    ]
+
+    exceed = dict.fromkeys(tests, 0)
+    if n_workers == 1:
+        _init_permutation_worker(values, codes, n_groups)
+        for test, seed_sequence, share in tasks:
+            exceed[test] += _permutation_chunks(
+                test, seed_sequence, share, memory_budget
+            )[1]
+        _PERMUTATION_DATA.clear()
+    else:
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_permutation_worker,
+            initargs=(values, codes, n_groups),
+        ) as executor:
+            futures = [
+                executor.submit(_permutation_chunks, test, seed_sequence,
+                                share, memory_budget)
+                for test, seed_sequence, share in tasks
+            ]
+            for future in futures:
+                test, count = future.result()
+                exceed[test] += count
+
+    # Add the observed labelling to the permutations, so p is never 0
+    statistic = (n - 1) * between / total if total > 0 else 0.0
+    result = {
+        "statistic": float(statistic),
+        "pvalue": float((exceed[None] + 1) / (n_permutations + 1)),
+        "pairwise": None,
+        "n_permutations": n_permutations,
+        "n": n,
+        "rank": bool(rank),
+    }
+    if pairwise:
+        pvalues = np.array([
+            (exceed[test] + 1) / (n_permutations + 1) for test in tests[1:]
+        ])
+        result["pairwise"] = pd.DataFrame({
+            "group_a": [labels[i] for i in a],
+            "group_b": [labels[i] for i in b],
+            "difference": means[a] - means[b],
+            "pvalue": pvalues,
+            "pvalue_adjusted": _adjust_pvalues(pvalues, correction),
+        })
+    return result
+
+
+def compare_subgroups(df, score_columns=(), outcome_columns=(),
+                      subgroup_column="class_assignment",
+                      n_permutations=10000, seed=1, n_workers=None,
+                      memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    Tests subgroup differences for several scores and outcomes, e.g. the
+    columns shown by plot_boxplot_by_subgroup and calculate_prevalence.
+
+    Scores get a Kruskal-Wallis test, binary outcomes a chi-square test,
+    and both a permutation test (on ranks for scores).
+
+    Parameters:
+    - df (pd.DataFrame): Data with the subgroup column.
+    - score_columns (list): Continuous scores, e.g. ["sofa", "oasis"].
+    - outcome_columns (list): 0/1 outcomes, e.g. ["organ_dysfunction",
+      "sepsis"].
+    - subgroup_column (str): Subgroup column. Default is
+      "class_assignment".
+    - n_permutations (int): Permutations per column. Default is 10000; 0
+      skips the permutation tests.
+    - seed (int): Random seed. Default is 1.
+    - n_workers (int): Worker processes for the permutation tests.
+    - memory_budget (int): Bytes per worker for one chunk of permutations.
+
+    Returns:
+    - pd.DataFrame: One row per column with 'test', 'statistic', 'dof',
+      'pvalue' and 'permutation_pvalue'.
+    """
+    import pandas as pd
+    from scipy.stats import chi2_contingency
+
+    rows = []
+    for column in list(score_columns) + list(outcome_columns):
+        if column in score_columns:
+            result = kruskal_wallis(df, column, subgroup_column)
+            row = {"test": "kruskal-wallis", **result}
+        else:
+            table = pd.crosstab(df[subgroup_column], df[column])
+            chi2, pvalue, dof, _ = chi2_contingency(table, correction=False)
+            row = {"test": "chi-square", "statistic": chi2, "pvalue": pvalue,
+                   "dof": dof, "n": int(table.to_numpy().sum())}
+        if n_permutations:
+            row["permutation_pvalue"] = permutation_test(
+                df, column, subgroup_column,
+                n_permutations=n_permutations,
+                rank=column in score_columns, seed=seed,
+                n_workers=n_workers, memory_budget=memory_budget,
+                pairwise=False,
+            )["pvalue"]
+        rows.append({"column": column, **row})
+    return pd.DataFrame(rows).set_index("column")
@@ -0,0 +1,193 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from .data_preprocessing import assign_age_bucket
+from .lca import encode_categories, fit_lca
+
+# Strata that can be derived when they are not already columns of the data
+AGE_BUCKET_COLUMN = "age_bucket"
+
+# Worker-side view of the shared feature matrix, set by _attach_matrix
+_SHARED = {}
+
+
+def _attach_matrix(name, shape, dtype):
+    """
+    Worker initializer: maps the shared feature matrix into this process
+    without copying it.
+
+    Parameters:
+    - name (str): Name of the shared memory block.
+    - shape (tuple): Shape of the feature matrix.
+    - dtype (str): dtype of the feature matrix.
+
+    Returns:
+    - None
+    """
+    block = shared_memory.SharedMemory(name=name)
+    _SHARED["block"] = block
+    _SHARED["matrix"] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _fit_stratum(model, positions, n_classes, model_kwargs):
+    """
+    Fits one model on the rows of a single stratum.
+
+    Parameters:
+    - model (str): 'lca' or 'kmeans'.
+    - positions (np.ndarray): Row positions of the stratum in the shared
+      feature matrix.
+    - n_classes (int): Number of latent classes or clusters.
+    - model_kwargs (dict): Extra arguments for fit_lca or KMeans.
+
+    Returns:
+    - tuple: (fitted model, 1-based class labels for the stratum rows).
+    """
+    from threadpoolctl import threadpool_limits
+
+    rows = _SHARED["matrix"][positions]
+
+    # Parallelism comes from the process pool; keep BLAS/OpenMP in each
+    # worker single-threaded to avoid oversubscribing the cores
+    with threadpool_limits(limits=1):
+        if model == "lca":
+            fitted = fit_lca(rows, n_classes, **model_kwargs)
+            # Rows dropped for missing values have predclass 0
+            labels = np.where(
+                fitted["predclass"] > 0, fitted["predclass"], np.nan
+            )
+            # float32 halves the posterior sent back to the parent process
+            fitted["posterior"] = fitted["posterior"].astype(np.float32)
+        else:
+            from sklearn.cluster import KMeans
+
+            kwargs = {"random_state": 0, **model_kwargs}
+            fitted = KMeans(n_clusters=n_classes, **kwargs).fit(rows)
+            labels = fitted.labels_ + 1
+
+    return fitted, labels
+
+
+def _stratum_keys(df, strata):
+    """
+    Returns the columns that define the strata, deriving the age bucket
+    from 'age_at_admission' when needed.
+
+    Parameters:
+    - df (pd.DataFrame): The cohort.
+    - strata (list): Stratum column names.
+
+    Returns:
+    - pd.DataFrame: One column per stratum variable, aligned with df.
+    """
+    keys = pd.DataFrame(index=df.index)
+    for column in strata:
+        if column in df:
+            keys[column] = df[column]
+        elif column == AGE_BUCKET_COLUMN:
+            keys[column] = assign_age_bucket(df["age_at_admission"])
+        else:
+            raise KeyError(f"Stratum column '{column}' not found")
+    return keys
+
+
+def fit_stratified(df, feature_columns, strata=(AGE_BUCKET_COLUMN,),
+                   model="lca", n_classes=6, n_workers=None,
+                   min_stratum_size=None, model_kwargs=None):
+    """
+    Fits a separate LCA or k-means model in every stratum of the cohort
+    (e.g. age bucket, gender, admission type) in a process pool.
+
+    The feature matrix is written once to shared memory and every worker
+    maps it instead of receiving a pickled copy of the DataFrame. For LCA,
+    categories are encoded on the full cohort, so class-conditional
+    probabilities of different strata use the same category layout.
+
+    Parameters:
+    - df (pd.DataFrame): Cohort with feature and stratum columns.
+    - feature_columns (list): Manifest variables (LCA) or features
+      (k-means).
+    - strata (tuple): Columns to stratify by. 'age_bucket' is derived from
+      'age_at_admission' when it is not a column. Default is age bucket.
+    - model (str): 'lca' or 'kmeans'. Default is 'lca'.
+    - n_classes (int): Number of classes or clusters per stratum. Default
+      is 6.
+    - n_workers (int): Number of worker processes. Default is the number of
+      strata, capped at the number of CPUs.
+    - min_stratum_size (int): Strata with fewer rows are skipped. Default
+      is n_classes.
+    - model_kwargs (dict): Extra arguments for fit_lca (e.g. max_iter,
+      n_rep) or sklearn's KMeans (e.g. n_init).
+
+    Returns:
+    - dict: 'models' (stratum key -> fitted model), 'assignments'
+      (DataFrame aligned with df holding the stratum columns and the
+      1-based 'class_assignment', NaN for skipped strata), and 'sizes'
+      (rows per stratum).
+    """
+    if model not in ("lca", "kmeans"):
+        raise ValueError(f"Unknown model '{model}', use 'lca' or 'kmeans'")
+    strata = list(strata)
+    model_kwargs = dict(model_kwargs or {})
+    if min_stratum_size is None:
+        min_stratum_size = n_classes
+
+    if model == "lca":
+        matrix, levels = encode_categories(df, feature_columns)
+        model_kwargs.setdefault("n_levels", [len(level) for level in levels])
+    else:
+        matrix = df[feature_columns].to_numpy(dtype=np.float64)
+    matrix = np.ascontiguousarray(matrix)
+
+    keys = _stratum_keys(df, strata)
+    groups = keys.groupby(strata, observed=True, sort=True).indices
+    sizes = pd.Series({key: len(rows) for key, rows in groups.items()})
+    groups = {
+        key: rows for key, rows in groups.items()
+        if len(rows) >= min_stratum_size
+    }
+
+    assignments = keys.copy()
+    assignments["class_assignment"] = pd.array(
+        [pd.NA] * len(keys), dtype="Int64"
+    )
+    models = {}
+    if not groups:
+        return {"models": models, "assignments": assignments, "sizes": sizes}
+
+    if n_workers is None:
+        n_workers = min(len(groups), os.cpu_count() or 1)
+
+    block = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+    shared = np.ndarray(matrix.shape, dtype=matrix.dtype, buffer=block.buf)
+    try:
+        shared[:] = matrix
+
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_attach_matrix,
+            initargs=(block.name, matrix.shape, matrix.dtype.str),
+        ) as executor:
+            futures = {
+                key: executor.submit(
+                    _fit_stratum, model, rows, n_classes, model_kwargs
+                )
+                for key, rows in groups.items()
+            }
+            labels = np.full(len(keys), np.nan)
+            for key, future in futures.items():
+                fitted, stratum_labels = future.result()
+                models[key] = fitted
+                labels[groups[key]] = stratum_labels
+    finally:
+        # The view must be released before the block can be closed
+        del shared
+        block.close()
+        block.unlink()
+
+    assignments["class_assignment"] = pd.array(labels).astype("Int64")
+    return {"models": models, "assignments": assignments, "sizes": sizes}
@@ -1,9 +1,10 @@
-import matplotlib.pyplot as plt
-import seaborn as sns
-import LCA_Analysis.utils.evaluation as evaluation
 import numpy as np
 import os
 
+# matplotlib, seaborn and the scikit-learn backed evaluation module are
+# imported inside the functions that use them, so importing this module does
+# not load the plotting or modelling stack.
+
 
 def save_plot(output_dir, name):
     """
@@ -18,41 +19,97 @@ def save_plot(output_dir, name):
     Returns:
     - None
     """
+    import matplotlib.pyplot as plt
+
     os.makedirs(output_dir, exist_ok=True)
     plt.savefig(f"{output_dir}/{name}.png")
 
 
+def _draw_boxes(ax, box_stats, palette):
+    """
+    Draws precomputed box plot statistics in the style of sns.boxplot.
+
+    Parameters:
+    - ax (matplotlib.axes.Axes): Axes to draw on.
+    - box_stats (list): Output of aggregates.sketch_box_stats.
+    - palette (str): Seaborn palette name for the box colors.
+
+    Returns:
+    - None
+    """
+    import seaborn as sns
+
+    positions = np.arange(len(box_stats))
+    artists = ax.bxp(
+        box_stats,
+        positions=positions,
+        widths=0.8,
+        patch_artist=True,
+        showfliers=True,
+        medianprops={"color": "0.25"},
+        whiskerprops={"color": "0.25"},
+        capprops={"color": "0.25"},
+        flierprops={"marker": "d", "markerfacecolor": "0.25",
+                    "markeredgecolor": "0.25", "markersize": 5},
+    )
+    colors = sns.color_palette(palette, len(box_stats))
+    for box, color in zip(artists["boxes"], colors):
+        box.set_facecolor(color)
+        box.set_edgecolor("0.25")
+    ax.set_xticks(positions)
+    ax.set_xticklabels([str(stats["label"]) for stats in box_stats])
+
+
 def plot_subgroup_characteristics(
-    df, bubble_size_scale=10, save_plots=False, output_dir="../output/plots"
+    df, bubble_size_scale=10, save_plots=False, output_dir="../output/plots",
+    age_sketch=None
 ):
     """
     Creates a bubble plot of subgroup characteristics by multimorbidity count
     and a box plot of age distribution within subgroups.
 
+    Both plots are drawn from aggregates: one bubble per distinct
+    (subgroup, multimorbidity count) and box statistics from a value
+    sketch of age, so the plotting cost depends on the number of subgroups
+    and not on the number of patients.
+
     Parameters:
     - df (pd.DataFrame): DataFrame containing 'class_assignment',
-      'count_morbidity', 'percent', and 'age_at_admission' columns.
+      'count_morbidity', 'percent', and 'age_at_admission' columns, or the
+      bubbles from aggregates.bubble_points when age_sketch is given.
     - bubble_size_scale (float): Scaling factor for bubble sizes in
       the bubble plot. Default is 10.
     - save_plots (bool): Whether to save the plots as images.
       Default is False.
     - output_dir (str): Directory to save the plots if save_plots=True.
       Default is "plots".
+    - age_sketch (pd.Series): Precomputed aggregates.value_sketch of
+      'age_at_admission' by 'class_assignment', e.g. merged from shards.
+      Default computes it from df.
 
     Returns:
     - None (displays the plots and optionally saves them to
       the specified directory).
     """
+    import matplotlib.pyplot as plt
+    from LCA_Analysis.utils.aggregates import (
+        bubble_points, sketch_box_stats, value_sketch,
+    )
+
+    points = bubble_points(df)
+    if age_sketch is None:
+        age_sketch = value_sketch(df, "age_at_admission")
+
     plt.figure(figsize=(15, 8))
 
     # Bubble Plot
     plt.subplot(1, 2, 1)
     plt.scatter(
-        x=df['class_assignment'],
-        y=df['count_morbidity'],
-        s=df['percent'] * bubble_size_scale,
+        x=points['class_assignment'],
+        y=points['count_morbidity'],
+        s=points['percent'] * bubble_size_scale,
         alpha=1,
-        c=df['class_assignment'],
+        c=points['class_assignment'],
         cmap='Set1'
     )
     plt.xlabel("Subgroup")
@@ -70,13 +127,8 @@ def plot_subgroup_characteristics(
     )
 
     # Box Plot
-    plt.subplot(1, 2, 2)
-    sns.boxplot(
-        data=df,
-        x="class_assignment",
-        y="age_at_admission",
-        palette="Set1"
-    )
+    ax = plt.subplot(1, 2, 2)
+    _draw_boxes(ax, sketch_box_stats(age_sketch), "Set1")
     plt.xlabel("Subgroup")
     plt.ylabel("Age (years)")
     plt.title("Boxplot of Age Distribution in Subgroups")
@@ -90,7 +142,8 @@ def plot_subgroup_characteristics(
 
 def plot_roc_curves(
     df, feature_columns, colors,
-    save_plots=False, output_dir="../output/plots", cv_splits=10
+    save_plots=False, output_dir="../output/plots", cv_splits=10,
+    features=None
 ):
     """
     Plots ROC curves for each unique class in 'class_assignment'
@@ -101,17 +154,22 @@ def plot_roc_curves(
     - feature_columns (list): Feature columns for logistic regression.
     - colors (list): Colors for each class's ROC curve.
     - cv_splits (int): Number of splits for cross-validation. Default is 10.
+    - features (scipy.sparse matrix): Extra sparse features aligned with the
+      rows of df (see evaluation.calculate_auc_for_class). Default is None.
 
     Returns:
     - None
     """
+    import matplotlib.pyplot as plt
+    import LCA_Analysis.utils.evaluation as evaluation
+
     plt.figure(figsize=(10, 8))
 
     for i, class_label in enumerate(sorted(df["class_assignment"].unique())):
         print(f"Processing class {class_label} vs. all")
 
         fpr, tpr, auc_score = evaluation.calculate_auc_for_class(
-            df, class_label, feature_columns, cv_splits
+            df, class_label, feature_columns, cv_splits, features=features
         )
         print(
             f"Cross-validated AUC-ROC for class {class_label} vs. all: "
@@ -149,7 +207,9 @@ def plot_subgroup_bar_plot(df, save_plots=False, output_dir="../output/plots"):
     Returns:
     - None
     """
-    cmap = plt.cm.get_cmap('tab10')
+    import matplotlib.pyplot as plt
+
+    cmap = plt.get_cmap('tab10')
 
     fig, axes = plt.subplots(2, 3, figsize=(18, 10), sharey=True)
     axes = axes.flatten()
@@ -181,7 +241,9 @@ def plot_polar_subgroup(df, save_plots=False, output_dir="../output/plots"):
     Returns:
     - None
     """
-    cmap = plt.cm.get_cmap('tab10')
+    import matplotlib.pyplot as plt
+
+    cmap = plt.get_cmap('tab10')
 
     fig, axes = plt.subplots(
         2, 3, subplot_kw={'projection': 'polar'}, figsize=(18, 10)
@@ -241,6 +303,8 @@ def plot_polar_all(
     Returns:
     - None
     """
+    import matplotlib.pyplot as plt
+
     num_conditions = len(mean_prevalence)
     angles = np.linspace(0, 2 * np.pi, num_conditions, endpoint=False)
     heights = mean_prevalence.values
@@ -285,6 +349,8 @@ def plot_bar(data, y_label="Percent prevalence", colors=("red", "blue"),
     Returns:
     - None
     """
+    import matplotlib.pyplot as plt
+
     x = np.arange(len(data.index))
     bar_width = 0.35
     fig, ax = plt.subplots(figsize=(8, 6))
@@ -310,30 +376,39 @@ def plot_bar(data, y_label="Percent prevalence", colors=("red", "blue"),
 
 
 def plot_boxplot_by_subgroup(
-    df, score_column, save_plots=False, output_dir="../output/plots"
+    df, score_column, save_plots=False, output_dir="../output/plots",
+    sketch=None
 ):
     """
     Plot a boxplot for a given score column grouped by subgroups.
 
+    The boxes are drawn from a value sketch of the score per subgroup
+    instead of the per-patient column.
+
     Parameters:
     - df (DataFrame): The DataFrame containing the data.
     - score_column (str): The name of the column to plot
       (e.g., 'SOFA score' or 'OASIS score').
     - output_dir (str): Directory to save the plot if save_plots=True.
       Default is "plots".
+    - sketch (pd.Series): Precomputed aggregates.value_sketch of
+      score_column by subgroup, e.g. merged from shards. Default computes
+      it from df.
 
     Returns:
     - None
     """
-    # Ensure 'class_assignment' column is renamed to 'Subgroup'
-    df.rename(columns={'class_assignment': 'Subgroup'}, inplace=True)
+    import matplotlib.pyplot as plt
+    from LCA_Analysis.utils.aggregates import sketch_box_stats, value_sketch
+
+    if sketch is None:
+        # Ensure 'class_assignment' column is renamed to 'Subgroup'
+        df.rename(columns={'class_assignment': 'Subgroup'}, inplace=True)
+        sketch = value_sketch(df, score_column, group_column='Subgroup')
 
     # Create the boxplot
     plt.figure(figsize=(8, 6))
-    sns.boxplot(
-        data=df, x='Subgroup', y=score_column, palette='tab10',
-        order=sorted(df['Subgroup'].unique())
-    )
+    _draw_boxes(plt.gca(), sketch_box_stats(sketch), 'tab10')
 
     plt.ylabel(f"{score_column} score")
     plt.xlabel('Subgroup')
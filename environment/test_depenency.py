@@ -12,7 +12,8 @@ dependencies = [
     ("seaborn", "seaborn"),
     ("networkx", "networkx"),
     ("scipy", "scipy"),
-    ("pylca", "pylca")
+    ("pylca", "pylca"),
+    ("duckdb", "duckdb")
 ]
 
 # Test the import of each package
@@ -0,0 +1,89 @@
+import os
+import subprocess
+import sys
+
+# Repository root, so that the LCA_Analysis package is importable
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Heavy packages that must not be loaded just by importing the utils modules
+HEAVY_MODULES = ["matplotlib", "seaborn", "sklearn", "scipy"]
+
+# (description, statement to time, import-time budget in seconds)
+import_checks = [
+    ("LCA_Analysis.utils package",
+     "import LCA_Analysis.utils",
+     0.1),
+    ("data_preprocessing (import)",
+     "import LCA_Analysis.utils.data_preprocessing",
+     0.1),
+    ("data_preprocessing (reticulate source_python)",
+     "import runpy; "
+     "runpy.run_path('LCA_Analysis/utils/data_preprocessing.py')",
+     0.1),
+    ("visualization",
+     "import LCA_Analysis.utils.visualization",
+     0.5),
+    ("evaluation",
+     "import LCA_Analysis.utils.evaluation",
+     0.1),
+]
+
+
+def measure_import_time(statement):
+    """
+    Runs a statement in a fresh interpreter with `python -X importtime` and
+    collects the import timings it reports.
+
+    Parameters:
+    - statement (str): Python statement to execute.
+
+    Returns:
+    - tuple: (total cumulative import time in seconds, set of top-level
+      package names that were imported).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    total_us = 0
+    packages = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        packages.add(name.strip().split(".")[0])
+        # Only top-level entries (no indentation) add to the total, nested
+        # imports are already included in their parent's cumulative time
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative)
+
+    return total_us / 1e6, packages
+
+
+failed = False
+for description, statement, budget in import_checks:
+    try:
+        seconds, packages = measure_import_time(statement)
+    except RuntimeError as e:
+        print(f"Failed to import {description}: {e}")
+        failed = True
+        continue
+
+    heavy = sorted(set(HEAVY_MODULES) & packages)
+    if seconds > budget or heavy:
+        print(f"Import budget exceeded for {description}: {seconds:.3f}s "
+              f"(budget {budget:.3f}s), heavy modules loaded: {heavy}")
+        failed = True
+    else:
+        print(f"{description} imported in {seconds:.3f}s "
+              f"(budget {budget:.3f}s)")
+
+if failed:
+    sys.exit(1)  # Exit if any import is over budget
+
+print("All imports are within their start-up budget!")
@@ -1,10 +1,14 @@
 from sklearn.cluster import KMeans
+from scipy import sparse
+import numpy as np
+import pandas as pd
 import warnings
 
 warnings.filterwarnings("ignore")
 
 
-def kmeans_by_age_group(patients, clusters_count=3, group_by_gender=True):
+def kmeans_by_age_group(patients, clusters_count=3, group_by_gender=True,
+                        features=None):
     """
     Apply KMeans clustering to patient data grouped by age & optionally gender.
 
@@ -18,6 +22,12 @@ def kmeans_by_age_group(patients, clusters_count=3, group_by_gender=True):
     - clusters_count (int): Number of clusters for KMeans. Default is 3.
     - group_by_gender (bool): If True, groups by 'age_group' and 'gender'.
                               Default is True.
+    - features (scipy.sparse matrix): Extra sparse features with one row per
+                              row of patients, e.g. the ICD-9 code matrix of
+                              sql_queries/diagnosis_features.py. Their group
+                              means are computed with a sparse product and
+                              clustered next to the indicator means, without
+                              densifying. Default is None.
 
     Returns:
     - tuple: Containing fitted KMeans model and DataFrame with cluster labels.
@@ -29,7 +39,29 @@ def kmeans_by_age_group(patients, clusters_count=3, group_by_gender=True):
           .mean()
           )
 
-    kmeans = KMeans(n_clusters=clusters_count, random_state=0).fit(df)
+    if features is None:
+        kmeans = KMeans(n_clusters=clusters_count, random_state=0).fit(df)
+    else:
+        # Sparse (groups x patients) membership matrix with 1 / group size,
+        # so its product with the features gives the group means
+        groups = pd.MultiIndex.from_frame(patients[group_cols])
+        rows = pd.Index(df.index).get_indexer(
+            groups if len(group_cols) > 1 else groups.get_level_values(0)
+        )
+        # Patients with a missing group are left out, as in groupby
+        patient = np.flatnonzero(rows >= 0)
+        rows = rows[patient]
+        sizes = np.bincount(rows, minlength=len(df))
+        membership = sparse.csr_matrix(
+            (1.0 / sizes[rows], (rows, patient)),
+            shape=(len(df), len(patients))
+        )
+        X = sparse.hstack(
+            [sparse.csr_matrix(df.to_numpy(dtype=float)),
+             membership @ features],
+            format='csr'
+        )
+        kmeans = KMeans(n_clusters=clusters_count, random_state=0).fit(X)
 
     df['cluster'] = kmeans.labels_
 
@@ -1,11 +1,13 @@
 from sklearn.cluster import KMeans
+from scipy import sparse
 import pandas as pd
 
 
 def kmeans_w_age(patients_age_at_admission,
                  include_gender=False,
                  clusters_count=6,
-                 bin_age=False):
+                 bin_age=False,
+                 features=None):
     """
     Perform KMeans clustering on patient age at admission data.
 
@@ -17,6 +19,10 @@ def kmeans_w_age(patients_age_at_admission,
       admission and elixhauser indicators.
     - clusters_count (int): Number of clusters to use in the KMeans algorithm.
       Default is 6.
+    - features (scipy.sparse matrix): Extra sparse features with one row per
+      row of patients_age_at_admission, e.g. the ICD-9 code matrix of
+      sql_queries/diagnosis_features.py. They are clustered together with
+      the DataFrame columns without being densified. Default is None.
 
     Returns:
     - tuple: A tuple containing the KMeans model instance and the DataFrame
@@ -28,7 +34,14 @@ def kmeans_w_age(patients_age_at_admission,
     drop_cols = ['hadm_id', 'gender'] if not include_gender else 'hadm_id'
     df = patients_age_at_admission.drop(columns=drop_cols, errors='ignore')
     kmeans = KMeans(n_clusters=clusters_count, random_state=0)
-    df['cluster'] = kmeans.fit_predict(df)
+    if features is None:
+        df['cluster'] = kmeans.fit_predict(df)
+    else:
+        X = sparse.hstack(
+            [sparse.csr_matrix(df.to_numpy(dtype=float)), features],
+            format='csr'
+        )
+        df['cluster'] = kmeans.fit_predict(X)
     if bin_age:
         bins = [16, 25, 45, 65, 85, 96]
         labels = ['16-24', '25-44', '45-64', '65-84', '85-95']
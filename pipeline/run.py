@@ -0,0 +1,298 @@
+"""
+Runs the analysis from the MIMIC parquet tables to the plots:
+
+    python -m pipeline.run --data-dir /workspaces/data/mimic_parquet
+
+See pipeline/README.md for the stages and options.
+"""
+import argparse
+import glob
+import os
+import sys
+
+from pipeline import stages as s
+from pipeline.runner import FAILED, BLOCKED, run_pipeline, stage
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SQL_QUERIES_DIR = os.path.join(REPOSITORY_DIR, "sql_queries")
+
+
+def build_pipeline(data_dir, work_dir, engine="python", class_range=(7, 7),
+                   n_rep=5, max_iter=7000, n_permutations=10000,
+                   model_version="lca", warm_start=True, relabel="auto"):
+    """
+    Declares the stages of the analysis:
+
+        extract -> preprocess -> fit -> reassign -> enrich -> evaluate
+                                    \\-> store    \\-> plots
+        extract -> kmeans
+
+    Parameters:
+    - data_dir (str): Directory with the MIMIC parquet files (see
+      sql_queries/README.md).
+    - work_dir (str): Directory for all intermediate files and plots.
+    - engine (str): LCA engine, 'python' or 'R'. Default is 'python'.
+    - class_range (tuple): Smallest and largest number of LCA classes.
+      Default is (7, 7).
+    - n_rep (int): Random starts per LCA model. Default is 5.
+    - max_iter (int): Maximum EM iterations. Default is 7000.
+    - n_permutations (int): Permutations per tested column. Default is
+      10000.
+    - model_version (str): Name of the model in the assignment store.
+      Default is 'lca'.
+    - warm_start (bool): Start each number of classes from the previous
+      model with a class split (python engine). Default is True.
+    - relabel (str): Subgroup numbering, 'size', 'notebook' or 'none'
+      (see stages.reassign). Default 'auto' uses the notebook's numbering
+      for the notebook's fit (R engine, 7 classes) and 'size' otherwise.
+
+    Returns:
+    - list: Stage definitions for run_pipeline.
+    """
+    raw = os.path.join(work_dir, "raw_data")
+    processed = os.path.join(work_dir, "processed_data")
+    plots = os.path.join(work_dir, "plots")
+    store = os.path.join(work_dir, "assignment_store")
+
+    def raw_path(name):
+        return os.path.join(raw, f"{name}.csv")
+
+    def processed_path(name):
+        return os.path.join(processed, f"{name}.csv")
+
+    def sql(script):
+        return os.path.join(SQL_QUERIES_DIR, script)
+
+    tables = sorted(
+        glob.glob(os.path.join(data_dir, "*.parquet"))
+        + glob.glob(os.path.join(data_dir, "*", "*.parquet"))
+    )
+    post_analysis_tables = ["sofa", "angus", "oasis", "patients", "sepsis"]
+    kmeans_tables = ["patients_w_elixhauser_age",
+                     "patients_w_elixhauser_age_group"]
+    if relabel == "auto":
+        notebook_fit = engine == "R" and tuple(class_range) == (7, 7)
+        relabel = "notebook" if notebook_fit else "size"
+    # Only the python engine reports its iterations
+    fit_outputs = [processed_path("LCA_posterior_probabilities"),
+                   processed_path("LCA_latent_class_data")]
+    fit_options = {}
+    if engine == "R":
+        fit_options = {"code": [
+            s.FIT_LCA_SCRIPT,
+            os.path.join(REPOSITORY_DIR, "LCA_Analysis", "R",
+                         "LCA_analysis.R"),
+        ]}
+    if engine == "python":
+        fit_outputs.append(processed_path("LCA_fit_iterations"))
+        fit_options = {
+            "warm_start": warm_start,
+            "iterations_path": processed_path("LCA_fit_iterations"),
+        }
+
+    return [
+        # extract
+        stage(
+            "extract_lca", s.export_sql_script,
+            inputs=tables
+            + [sql("utilities/raw_patient_disease_statistics.sql")],
+            outputs=[raw_path("LCA_raw_data")],
+            data_dir=data_dir,
+            script="utilities/raw_patient_disease_statistics.sql",
+            exports={"LCA_raw_data": raw_path("LCA_raw_data")},
+        ),
+        stage(
+            "extract_post_analysis", s.export_sql_script,
+            inputs=tables
+            + [sql("utilities/import_tables_LCA_post_analysis.sql")],
+            outputs=[raw_path(name) for name in post_analysis_tables],
+            data_dir=data_dir,
+            script="utilities/import_tables_LCA_post_analysis.sql",
+            exports={name: raw_path(name) for name in post_analysis_tables},
+        ),
+        stage(
+            "extract_kmeans_age", s.export_sql_script,
+            inputs=tables + [sql("utilities/patients_w_elixhauser_age.sql")],
+            outputs=[raw_path(kmeans_tables[0])],
+            data_dir=data_dir,
+            script="utilities/patients_w_elixhauser_age.sql",
+            exports={kmeans_tables[0]: raw_path(kmeans_tables[0])},
+        ),
+        stage(
+            "extract_kmeans_age_group", s.export_sql_script,
+            inputs=tables
+            + [sql("utilities/patients_w_elixhauser_age_group.sql")],
+            outputs=[raw_path(kmeans_tables[1])],
+            data_dir=data_dir,
+            script="utilities/patients_w_elixhauser_age_group.sql",
+            exports={kmeans_tables[1]: raw_path(kmeans_tables[1])},
+        ),
+        # LCA branch
+        stage(
+            "preprocess", s.preprocess,
+            inputs=[raw_path("LCA_raw_data")],
+            outputs=[processed_path("LCA_preprocessed_data")],
+            input_path=raw_path("LCA_raw_data"),
+            output_path=processed_path("LCA_preprocessed_data"),
+        ),
+        stage(
+            "fit", s.fit_lca_model,
+            inputs=[processed_path("LCA_preprocessed_data")],
+            outputs=fit_outputs,
+            input_path=processed_path("LCA_preprocessed_data"),
+            posterior_path=processed_path("LCA_posterior_probabilities"),
+            latent_class_path=processed_path("LCA_latent_class_data"),
+            plot_dir=plots,
+            class_range=tuple(class_range),
+            engine=engine,
+            n_rep=n_rep,
+            max_iter=max_iter,
+            **fit_options,
+        ),
+        stage(
+            "store", s.save_assignment_store,
+            inputs=[processed_path("LCA_latent_class_data"),
+                    processed_path("LCA_posterior_probabilities")],
+            outputs=[os.path.join(store, model_version, "metadata.json")],
+            latent_class_path=processed_path("LCA_latent_class_data"),
+            posterior_path=processed_path("LCA_posterior_probabilities"),
+            store_dir=store,
+            model_version=model_version,
+        ),
+        stage(
+            "reassign", s.reassign,
+            inputs=[processed_path("LCA_latent_class_data"),
+                    processed_path("LCA_posterior_probabilities")],
+            outputs=[processed_path("LCA_subgroups")],
+            latent_class_path=processed_path("LCA_latent_class_data"),
+            posterior_path=processed_path("LCA_posterior_probabilities"),
+            output_path=processed_path("LCA_subgroups"),
+            relabel=None if relabel == "none" else relabel,
+        ),
+        stage(
+            "enrich", s.enrich,
+            inputs=[processed_path("LCA_subgroups")]
+            + [raw_path(name) for name in post_analysis_tables],
+            outputs=[processed_path("LCA_subgroups_enriched")],
+            subgroups_path=processed_path("LCA_subgroups"),
+            sofa_path=raw_path("sofa"),
+            oasis_path=raw_path("oasis"),
+            angus_path=raw_path("angus"),
+            sepsis_path=raw_path("sepsis"),
+            patients_path=raw_path("patients"),
+            output_path=processed_path("LCA_subgroups_enriched"),
+        ),
+        stage(
+            "evaluate", s.evaluate_subgroups,
+            inputs=[processed_path("LCA_subgroups_enriched")],
+            outputs=[processed_path("subgroup_tests")],
+            enriched_path=processed_path("LCA_subgroups_enriched"),
+            output_path=processed_path("subgroup_tests"),
+            n_permutations=n_permutations,
+        ),
+        # Plot families, independent of each other
+        stage(
+            "plot_characteristics", s.plot_characteristics,
+            inputs=[processed_path("LCA_subgroups")],
+            outputs=[
+                os.path.join(plots, "subgroup_characteristics_plots.png")
+            ],
+            subgroups_path=processed_path("LCA_subgroups"),
+            plot_dir=plots,
+        ),
+        stage(
+            "plot_roc", s.plot_roc,
+            inputs=[processed_path("LCA_subgroups")],
+            outputs=[os.path.join(plots, "roc_curves_plots.png")],
+            subgroups_path=processed_path("LCA_subgroups"),
+            plot_dir=plots,
+        ),
+        stage(
+            "plot_prevalence", s.plot_prevalence,
+            inputs=[processed_path("LCA_subgroups")],
+            outputs=[os.path.join(plots, "plot_polar_all.png"),
+                     os.path.join(plots, "plot_polar_subgroup.png")],
+            subgroups_path=processed_path("LCA_subgroups"),
+            plot_dir=plots,
+        ),
+        stage(
+            "plot_severity", s.plot_severity,
+            inputs=[processed_path("LCA_subgroups_enriched")],
+            outputs=[os.path.join(plots, "plot_boxplot_sofa.png"),
+                     os.path.join(plots, "plot_boxplot_oasis.png"),
+                     os.path.join(plots, "plot_bar.png")],
+            enriched_path=processed_path("LCA_subgroups_enriched"),
+            plot_dir=plots,
+        ),
+        # k-means branch
+        stage(
+            "kmeans", s.run_kmeans,
+            inputs=[raw_path(name) for name in kmeans_tables],
+            outputs=[os.path.join(work_dir, "kmeans", "kmeans_w_age.csv"),
+                     os.path.join(work_dir, "kmeans",
+                                  "kmeans_by_age_group.csv")],
+            age_path=raw_path(kmeans_tables[0]),
+            age_group_path=raw_path(kmeans_tables[1]),
+            output_dir=os.path.join(work_dir, "kmeans"),
+        ),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split("\n")[0]
+    )
+    parser.add_argument("--data-dir", required=True,
+                        help="Directory with the MIMIC parquet files")
+    parser.add_argument("--work-dir", default="pipeline_output",
+                        help="Directory for intermediate files and plots")
+    parser.add_argument("--engine", choices=["python", "R"], default="python",
+                        help="LCA implementation")
+    parser.add_argument("--classes", type=int, nargs=2, default=(7, 7),
+                        metavar=("MIN", "MAX"),
+                        help="Range of LCA classes to fit")
+    parser.add_argument("--n-rep", type=int, default=5)
+    parser.add_argument("--max-iter", type=int, default=7000)
+    parser.add_argument("--permutations", type=int, default=10000)
+    parser.add_argument("--model-version", default="lca")
+    parser.add_argument("--relabel", default="auto",
+                        choices=["auto", "size", "notebook", "none"],
+                        help="Subgroup numbering (default: the notebook's "
+                             "for the notebook's R fit, else by size)")
+    parser.add_argument("--cold-start", action="store_true",
+                        help="Fit every number of classes from random "
+                             "starts (python engine)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Stages running at once (default: CPUs)")
+    parser.add_argument("--force", nargs="*", default=[],
+                        help="Stages to rerun even if up to date")
+    parser.add_argument("--only", nargs="*", default=None,
+                        help="Run only these stages and their upstream stages")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Show which stages would run")
+    args = parser.parse_args(argv)
+
+    stages = build_pipeline(
+        args.data_dir, args.work_dir, engine=args.engine,
+        class_range=args.classes, n_rep=args.n_rep, max_iter=args.max_iter,
+        n_permutations=args.permutations, model_version=args.model_version,
+        warm_start=not args.cold_start, relabel=args.relabel,
+    )
+    summary = run_pipeline(
+        stages,
+        os.path.join(args.work_dir, "pipeline_state.json"),
+        max_workers=args.workers,
+        force=args.force,
+        only=args.only,
+        dry_run=args.dry_run,
+    )
+    failed = [name for name, result in summary.items()
+              if result["status"] in (FAILED, BLOCKED)]
+    if failed:
+        print(f"Failed or blocked stages: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
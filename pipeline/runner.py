@@ -0,0 +1,485 @@
+import ast
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import textwrap
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# Read size when hashing input files
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Stage statuses recorded in the state file and in run summaries
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+BLOCKED = "blocked"
+PENDING = "pending"
+
+
+def stage(name, func, inputs=(), outputs=(), after=(), code=(), **kwargs):
+    """
+    Declares a pipeline stage.
+
+    Stages that read another stage's output depend on it automatically;
+    use `after` for ordering that is not visible in the files.
+
+    The stage's code is part of its fingerprint: the function, the
+    module-level helpers and values it uses, and every module of the
+    project it imports, directly or through other modules (see
+    stage_code). Other files the stage runs, such as R scripts, go in
+    `code`.
+
+    Parameters:
+    - name (str): Unique stage name.
+    - func (callable): Module-level function run as func(**kwargs). It
+      runs in a worker process, so it must be importable.
+    - inputs (list): Files the stage reads. Their contents decide whether
+      the stage has to run again.
+    - outputs (list): Files the stage writes. A stage whose outputs are
+      missing always runs.
+    - after (list): Names of stages that must finish first.
+    - code (list): Further files with code the stage runs. Like the
+      inputs, their contents decide whether the stage has to run again.
+    - kwargs: Arguments passed to func. They are part of the fingerprint,
+      so they must have a stable repr.
+
+    Returns:
+    - dict: The stage definition.
+    """
+    return {
+        "name": name,
+        "func": func,
+        "inputs": [os.fspath(path) for path in inputs],
+        "outputs": [os.fspath(path) for path in outputs],
+        "after": list(after),
+        "code": [os.fspath(path) for path in code],
+        "kwargs": kwargs,
+    }
+
+
+def stage_dependencies(stages):
+    """
+    Resolves the upstream stages of every stage from `after` and from
+    inputs produced by other stages, and checks that they form a DAG.
+
+    Parameters:
+    - stages (list): Stage definitions from stage().
+
+    Returns:
+    - dict: Stage name -> set of upstream stage names.
+    """
+    names = [s["name"] for s in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("Stage names must be unique")
+
+    producers = {}
+    for s in stages:
+        for path in s["outputs"]:
+            if path in producers:
+                raise ValueError(
+                    f"'{path}' is written by both '{producers[path]}' and "
+                    f"'{s['name']}'"
+                )
+            producers[path] = s["name"]
+
+    dependencies = {}
+    for s in stages:
+        upstream = set(s["after"])
+        unknown = upstream - set(names)
+        if unknown:
+            raise ValueError(
+                f"Stage '{s['name']}' runs after unknown stages {unknown}"
+            )
+        upstream.update(
+            producers[path] for path in s["inputs"] if path in producers
+        )
+        upstream.discard(s["name"])
+        dependencies[s["name"]] = upstream
+
+    # Kahn's algorithm; anything left over is on a cycle
+    remaining = {
+        name: set(upstream) for name, upstream in dependencies.items()
+    }
+    while remaining:
+        ready = [name for name, upstream in remaining.items() if not upstream]
+        if not ready:
+            raise ValueError(f"Stages form a cycle: {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for upstream in remaining.values():
+            upstream.difference_update(ready)
+    return dependencies
+
+
+def _file_digest(path, cache):
+    """
+    SHA-256 of a file's contents, reusing the digest recorded in the
+    previous run when the size and modification time are unchanged.
+
+    Parameters:
+    - path (str): File to hash.
+    - cache (dict): Path -> {'size', 'mtime_ns', 'sha256'}; updated in
+      place.
+
+    Returns:
+    - str: Hex digest, or 'missing' if the file does not exist.
+    """
+    try:
+        info = os.stat(path)
+    except FileNotFoundError:
+        return "missing"
+    cached = cache.get(path)
+    if cached and cached["size"] == info.st_size \
+            and cached["mtime_ns"] == info.st_mtime_ns:
+        return cached["sha256"]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    cache[path] = {
+        "size": info.st_size,
+        "mtime_ns": info.st_mtime_ns,
+        "sha256": digest.hexdigest(),
+    }
+    return cache[path]["sha256"]
+
+
+def _project_root(func):
+    """
+    Directory the module of func is imported from, e.g. the repository
+    root for pipeline.stages.
+    """
+    root = os.path.dirname(os.path.abspath(inspect.getsourcefile(func)))
+    if func.__module__ != "__main__":
+        for _ in func.__module__.split(".")[1:]:
+            root = os.path.dirname(root)
+    return root
+
+
+def _module_files(name, root):
+    """
+    Files executed when importing module `name` from the project at root:
+    the module itself and the __init__.py of its packages. Modules outside
+    the project (the standard library, installed packages) give [].
+    """
+    parts = name.split(".")
+    files = []
+    for i in range(1, len(parts) + 1):
+        base = os.path.join(root, *parts[:i])
+        for path in (os.path.join(base, "__init__.py"), f"{base}.py"):
+            if os.path.isfile(path):
+                files.append(path)
+                break
+        else:
+            if not os.path.isdir(base):
+                return files
+    return files
+
+
+def _imported_names(tree, package):
+    """
+    Absolute names of the modules imported anywhere in tree, including
+    imports inside functions. For `from a import b`, both a and a.b are
+    returned, since b may be a submodule.
+    """
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                base = importlib.util.resolve_name(
+                    "." * node.level + base, package
+                )
+            names.append(base)
+            names += [f"{base}.{alias.name}" for alias in node.names]
+    return names
+
+
+def stage_code(func):
+    """
+    Collects the code a stage function depends on.
+
+    Parameters:
+    - func (callable): Stage function.
+
+    Returns:
+    - tuple: (sources, files) where sources holds the source of func and
+      of the functions of its module it calls, and the repr of the
+      module-level values they use, and files are the sorted paths of the
+      project modules imported by them, directly or indirectly.
+    """
+    root = _project_root(func)
+    package = func.__module__.rpartition(".")[0]
+    sources = []
+    pending = []
+    functions = [func]
+    seen = set()
+    while functions:
+        current = functions.pop()
+        if current.__name__ in seen:
+            continue
+        seen.add(current.__name__)
+        source = textwrap.dedent(inspect.getsource(current))
+        sources.append(source)
+        pending += _imported_names(ast.parse(source), package)
+        for name in current.__code__.co_names:
+            value = current.__globals__.get(name)
+            if inspect.isfunction(value) \
+                    and value.__module__ == func.__module__:
+                functions.append(value)
+            elif value is not None and not inspect.ismodule(value) \
+                    and not callable(value):
+                sources.append(f"{name} = {value!r}")
+
+    files = set()
+    while pending:
+        name = pending.pop()
+        for path in _module_files(name, root):
+            if path in files:
+                continue
+            files.add(path)
+            module = os.path.relpath(path, root)[:-3].replace(os.sep, ".")
+            if module.endswith(".__init__"):
+                module_package = module[:-len(".__init__")]
+            else:
+                module_package = module.rpartition(".")[0]
+            with open(path) as f:
+                pending += _imported_names(ast.parse(f.read()),
+                                           module_package)
+    return sources, sorted(files)
+
+
+def stage_fingerprint(stage_def, file_cache, code_cache=None):
+    """
+    Fingerprint of everything a stage's result depends on: the contents of
+    its inputs, its arguments and its code (see stage_code), including
+    the project modules it imports.
+
+    Parameters:
+    - stage_def (dict): Stage definition from stage().
+    - file_cache (dict): Digest cache passed to _file_digest.
+    - code_cache (dict): Stage function -> stage_code result, shared
+      between the stages of a run. Default does not cache.
+
+    Returns:
+    - str: Hex digest.
+    """
+    func = stage_def["func"]
+    if code_cache is None:
+        code_cache = {}
+    if func not in code_cache:
+        code_cache[func] = stage_code(func)
+    sources, code_files = code_cache[func]
+
+    digest = hashlib.sha256()
+    for source in sources:
+        digest.update(source.encode())
+    digest.update(repr(sorted(stage_def["kwargs"].items())).encode())
+    for path in code_files + stage_def["code"] + stage_def["inputs"]:
+        digest.update(path.encode())
+        digest.update(_file_digest(path, file_cache).encode())
+    return digest.hexdigest()
+
+
+def load_state(state_path):
+    """
+    Reads the state file of previous runs.
+
+    Parameters:
+    - state_path (str): Path of the JSON state file.
+
+    Returns:
+    - dict: 'stages' (name -> fingerprint and status of the last run) and
+      'files' (the digest cache); empty if there is no state yet.
+    """
+    if not os.path.exists(state_path):
+        return {"stages": {}, "files": {}}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def _save_state(state_path, state):
+    """
+    Writes the state file atomically, so an interrupted run never leaves a
+    truncated file behind.
+    """
+    directory = os.path.dirname(os.path.abspath(state_path))
+    os.makedirs(directory, exist_ok=True)
+    temporary = f"{state_path}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(temporary, state_path)
+
+
+def _run_stage(func, kwargs):
+    """
+    Worker entry point: runs one stage and reports failures as text, so
+    exceptions that cannot be pickled still reach the scheduler.
+    """
+    start = time.time()
+    try:
+        func(**kwargs)
+    except Exception:
+        return {"ok": False, "error": traceback.format_exc(),
+                "seconds": time.time() - start}
+    return {"ok": True, "error": None, "seconds": time.time() - start}
+
+
+def run_pipeline(stages, state_path, max_workers=None, force=(), only=None,
+                 dry_run=False, verbose=True):
+    """
+    Runs the stages of a pipeline in dependency order, independent stages
+    in parallel worker processes.
+
+    A stage is skipped when its fingerprint (inputs, arguments, and the
+    code of the stage and of the modules it imports) matches the last
+    successful run and all its outputs exist. The state file is updated
+    after every stage, so rerunning after a failure or an interruption
+    resumes where it stopped. When a stage fails, the stages
+    that depend on it are not run, while independent branches finish.
+
+    Parameters:
+    - stages (list): Stage definitions from stage().
+    - state_path (str): JSON file that records fingerprints between runs.
+    - max_workers (int): Maximum number of stages running at once. Default
+      is the number of CPUs.
+    - force (list): Stage names to run even if they are up to date. Their
+      downstream stages then run if their inputs change.
+    - only (list): Run only these stages and their upstream stages.
+      Default runs every stage.
+    - dry_run (bool): Only report which stages would run. Default is
+      False.
+    - verbose (bool): Print progress. Default is True.
+
+    Returns:
+    - dict: Stage name -> {'status', 'seconds', 'error'}, with status
+      'done', 'skipped', 'failed' or 'blocked' (an upstream stage failed),
+      or 'pending' for stages a dry run would run.
+    """
+    dependencies = stage_dependencies(stages)
+    by_name = {s["name"]: s for s in stages}
+    unknown = (set(force) | set(only or ())) - set(by_name)
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}")
+
+    if only is not None:
+        selected = set()
+        pending = list(only)
+        while pending:
+            name = pending.pop()
+            if name not in selected:
+                selected.add(name)
+                pending.extend(dependencies[name])
+        by_name = {name: s for name, s in by_name.items() if name in selected}
+
+    state = load_state(state_path)
+    code_cache = {}
+    summary = {}
+    waiting = dict(by_name)
+    running = {}
+
+    def log(message):
+        if verbose:
+            print(message, flush=True)
+
+    def upstream_statuses(name):
+        return [
+            summary.get(upstream, {}).get("status")
+            for upstream in dependencies[name] if upstream in by_name
+        ]
+
+    def is_ready(name):
+        return all(
+            status in (DONE, SKIPPED, PENDING)
+            for status in upstream_statuses(name)
+        )
+
+    def is_blocked(name):
+        return any(
+            status in (FAILED, BLOCKED) for status in upstream_statuses(name)
+        )
+
+    def is_up_to_date(name, fingerprint):
+        previous = state["stages"].get(name, {})
+        return (
+            name not in force
+            and previous.get("status") == DONE
+            and previous.get("fingerprint") == fingerprint
+            and all(os.path.exists(p) for p in by_name[name]["outputs"])
+        )
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while waiting or running:
+            for name in list(waiting):
+                if is_blocked(name):
+                    del waiting[name]
+                    summary[name] = {"status": BLOCKED, "seconds": 0.0,
+                                     "error": None}
+                    log(f"[blocked] {name}")
+                    continue
+                if not is_ready(name):
+                    continue
+                stage_def = waiting.pop(name)
+                fingerprint = stage_fingerprint(stage_def, state["files"],
+                                                code_cache)
+                # In a dry run, stages below one that would run would see
+                # new inputs, so they would run too
+                if PENDING not in upstream_statuses(name) \
+                        and is_up_to_date(name, fingerprint):
+                    summary[name] = {"status": SKIPPED, "seconds": 0.0,
+                                     "error": None}
+                    log(f"[skipped] {name} (up to date)")
+                elif dry_run:
+                    summary[name] = {"status": PENDING, "seconds": 0.0,
+                                     "error": None}
+                    log(f"[would run] {name}")
+                else:
+                    for path in stage_def["outputs"]:
+                        directory = os.path.dirname(path)
+                        if directory:
+                            os.makedirs(directory, exist_ok=True)
+                    log(f"[running] {name}")
+                    future = executor.submit(
+                        _run_stage, stage_def["func"], stage_def["kwargs"]
+                    )
+                    running[future] = (name, fingerprint)
+
+            if not running:
+                if waiting and not any(is_ready(n) or is_blocked(n)
+                                       for n in waiting):
+                    raise RuntimeError("Pipeline is stuck")
+                continue
+
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, fingerprint = running.pop(future)
+                result = future.result()
+                missing = [
+                    path for path in by_name[name]["outputs"]
+                    if not os.path.exists(path)
+                ]
+                if result["ok"] and missing:
+                    result = {**result, "ok": False,
+                              "error": f"Outputs not written: {missing}"}
+                status = DONE if result["ok"] else FAILED
+                summary[name] = {"status": status,
+                                 "seconds": result["seconds"],
+                                 "error": result["error"]}
+                state["stages"][name] = {
+                    "status": status,
+                    "fingerprint": fingerprint,
+                    "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "seconds": round(result["seconds"], 3),
+                }
+                _save_state(state_path, state)
+                log(f"[{status}] {name} ({result['seconds']:.1f}s)")
+                if not result["ok"]:
+                    log(result["error"])
+    return summary
@@ -0,0 +1,420 @@
+import os
+import shutil
+import subprocess
+
+# Manifest variables of the LCA, as in the formula of LCA_analysis.ipynb
+LCA_COLUMNS = [
+    "admission_type", "gender", "age_at_admission",
+    "congestive_heart_failure", "cardiac_arrhythmias", "valvular_disease",
+    "pulmonary_circulation", "peripheral_vascular", "hypertension",
+    "paralysis", "other_neurological", "chronic_pulmonary",
+    "diabetes_uncomplicated", "diabetes_complicated", "hypothyroidism",
+    "renal_failure", "liver_disease", "peptic_ulcer", "aids", "lymphoma",
+    "metastatic_cancer", "solid_tumor", "rheumatoid_arthritis",
+    "coagulopathy", "obesity", "weight_loss", "fluid_electrolyte",
+    "blood_loss_anemia", "deficiency_anemias", "alcohol_abuse", "drug_abuse",
+    "psychoses", "depression",
+]
+
+# Subgroup order of LCA_post_analysis.ipynb. It matches the classes of the
+# notebook's poLCA run (7 classes, seed 1) only
+CLASSES_MAPPING = {6: 1, 2: 2, 5: 3, 4: 4, 3: 5, 1: 6}
+# Subgroup colors used in LCA_post_analysis.ipynb
+ROC_COLORS = ["black", "red", "green", "blue", "cyan", "magenta"]
+PREVALENCE_COLORS = ["gray", "red", "green", "blue", "cyan", "pink"]
+
+FIT_LCA_SCRIPT = os.path.join(os.path.dirname(__file__), "fit_lca.R")
+
+
+def _use_file_backend():
+    """
+    Stages run in worker processes without a display, so plots are only
+    written to files.
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def export_sql_script(data_dir, script, exports):
+    """
+    Runs a \\copy export script from sql_queries on the local parquet
+    tables and writes its results as CSV files.
+
+    Parameters:
+    - data_dir (str): Directory with the MIMIC parquet files.
+    - script (str): Script path relative to sql_queries.
+    - exports (dict): Export name (the stem of the CSV the script would
+      write) -> CSV path to write.
+
+    Returns:
+    - None
+    """
+    from sql_queries.local_engine import (
+        connect_local_mimic, create_cohort_views, run_sql_script,
+    )
+
+    con = connect_local_mimic(data_dir)
+    try:
+        create_cohort_views(con)
+        results = run_sql_script(con, script)
+    finally:
+        con.close()
+    for name, path in exports.items():
+        results[name].to_csv(path, index=False)
+
+
+def preprocess(input_path, output_path):
+    """
+    Prepares the raw LCA export for the LCA fit (see preprocess_lca_data).
+
+    Parameters:
+    - input_path (str): LCA_raw_data.csv.
+    - output_path (str): Preprocessed CSV to write.
+
+    Returns:
+    - None
+    """
+    from LCA_Analysis.utils.data_preprocessing import preprocess_lca_data
+
+    preprocess_lca_data(input_path, output_path)
+
+
+def fit_lca_model(input_path, posterior_path, latent_class_path, plot_dir,
+                  class_range=(7, 7), engine="python", n_rep=5,
+                  max_iter=7000, seed=1, warm_start=True,
+                  iterations_path=None):
+    """
+    Fits the LCA for every number of classes in class_range and keeps the
+    model with the lowest AIC + BIC, as find_best_lca_model does, then
+    writes the posterior probabilities and class assignments.
+
+    Parameters:
+    - input_path (str): Preprocessed CSV from preprocess.
+    - posterior_path (str): Posterior probabilities CSV to write.
+    - latent_class_path (str): Data with 'class_assignment' to write.
+    - plot_dir (str): Directory for the poLCA plot (R engine).
+    - class_range (tuple): Smallest and largest number of classes.
+      Default is (7, 7), as in LCA_analysis.ipynb.
+    - engine (str): 'python' (utils/lca.py) or 'R' (poLCA through
+      fit_lca.R). Default is 'python'.
+    - n_rep (int): Random starts per cold-started model. Default is 5.
+    - max_iter (int): Maximum EM iterations. Default is 7000.
+    - seed (int): Random seed. Default is 1.
+    - warm_start (bool): Start each model after the first from the
+      previous one with its weakest class split (python engine). Default
+      is True.
+    - iterations_path (str): CSV for the iterations of every fit (python
+      engine). Default does not write it.
+
+    Returns:
+    - None
+    """
+    smallest, largest = class_range
+    if engine == "R":
+        subprocess.run(
+            ["Rscript", FIT_LCA_SCRIPT, input_path, posterior_path,
+             latent_class_path, plot_dir, str(smallest), str(largest),
+             str(n_rep), str(max_iter), str(seed)],
+            check=True,
+        )
+        return
+    if engine != "python":
+        raise ValueError(f"Unknown engine '{engine}', use 'python' or 'R'")
+
+    import pandas as pd
+    from LCA_Analysis.utils.lca import encode_categories, find_best_lca_model
+
+    df = pd.read_csv(input_path, index_col=0)
+    codes, levels = encode_categories(df, LCA_COLUMNS)
+    result = find_best_lca_model(
+        codes, range(smallest, largest + 1), max_iter=max_iter,
+        n_rep=n_rep, seed=seed, warm_start=warm_start,
+    )
+    best = result["best_model_aic_bic_combined"]
+    if iterations_path is not None:
+        result["iterations"].to_csv(iterations_path, index=False)
+
+    posterior = pd.DataFrame(
+        best["posterior"],
+        columns=[f"V{k + 1}" for k in range(best["nclass"])],
+    )
+    posterior.to_csv(posterior_path, index=False)
+    df["class_assignment"] = best["predclass"]
+    df.to_csv(latent_class_path, index=False)
+
+
+def save_assignment_store(latent_class_path, posterior_path, store_dir,
+                          model_version):
+    """
+    Adds the fitted model to the assignment store.
+
+    Parameters:
+    - latent_class_path (str): Data with 'class_assignment'.
+    - posterior_path (str): Posterior probabilities CSV.
+    - store_dir (str): Assignment store directory.
+    - model_version (str): Name of the model version.
+
+    Returns:
+    - None
+    """
+    from LCA_Analysis.utils.assignment_store import (
+        write_assignment_store_from_csv,
+    )
+
+    write_assignment_store_from_csv(
+        store_dir, model_version, latent_class_path, posterior_path
+    )
+
+
+def _size_classes_map(df):
+    """
+    Renumbers the classes by size, largest first, for process_morbidity_data.
+    Its keys are the labels reassign_class_assignment gives the kept classes.
+    """
+    counts = df["class_assignment"].value_counts()
+    renumbered = {
+        label: new for new, label in enumerate(sorted(counts.index), start=1)
+    }
+    by_size = sorted(counts.index,
+                     key=lambda label: (-counts[label], renumbered[label]))
+    return {renumbered[label]: rank
+            for rank, label in enumerate(by_size, start=1)}
+
+
+def reassign(latent_class_path, posterior_path, output_path, num_classes=6,
+             relabel="size"):
+    """
+    Keeps the most common classes, reorders them and adds the
+    multimorbidity counts, as at the start of LCA_post_analysis.ipynb.
+
+    Parameters:
+    - latent_class_path (str): Data with 'class_assignment'.
+    - posterior_path (str): Posterior probabilities CSV.
+    - output_path (str): Subgroup data CSV to write.
+    - num_classes (int): Number of classes to keep. Default is 6.
+    - relabel (str): Subgroup numbering: 'size' (largest subgroup first),
+      'notebook' (CLASSES_MAPPING, only meaningful for the notebook's
+      poLCA fit) or None (the order of the fitted classes). Default is
+      'size'.
+
+    Returns:
+    - None
+    """
+    import pandas as pd
+    from LCA_Analysis.utils.data_postprocessing import (
+        process_morbidity_data, reassign_classes,
+    )
+
+    df = pd.read_csv(latent_class_path)
+    df_prob = pd.read_csv(posterior_path)
+    df, _ = reassign_classes(df, df_prob, num_classes=num_classes)
+    if relabel == "size":
+        classes_map = _size_classes_map(df)
+    elif relabel == "notebook":
+        classes_map = CLASSES_MAPPING
+    elif relabel is None:
+        classes_map = None
+    else:
+        raise ValueError(
+            f"Unknown relabel '{relabel}', use 'size', 'notebook' or None"
+        )
+    df = process_morbidity_data(df, classes_map)
+    df.to_csv(output_path, index=False)
+
+
+def enrich(subgroups_path, sofa_path, oasis_path, angus_path, sepsis_path,
+           patients_path, output_path):
+    """
+    Adds severity scores and outcomes to the subgroup data, as
+    LCA_post_analysis.ipynb does before the box plots.
+
+    Parameters:
+    - subgroups_path (str): Output of reassign.
+    - sofa_path, oasis_path, angus_path, sepsis_path, patients_path (str):
+      CSV exports of import_tables_LCA_post_analysis.sql.
+    - output_path (str): Enriched CSV to write.
+
+    Returns:
+    - None
+    """
+    import pandas as pd
+
+    df = pd.read_csv(subgroups_path)
+    patients = pd.read_csv(patients_path)
+    patients["dod_converion"] = patients["dod"].isna()
+    tables = [
+        (sofa_path, ["subject_id", "hadm_id", "sofa"]),
+        (oasis_path, ["subject_id", "hadm_id", "oasis"]),
+        (angus_path, ["subject_id", "hadm_id", "organ_dysfunction",
+                      "explicit_sepsis"]),
+        (sepsis_path, ["subject_id", "hadm_id", "sepsis"]),
+    ]
+    for path, columns in tables:
+        df = pd.merge(df, pd.read_csv(path, usecols=columns))
+    df = pd.merge(df, patients[["subject_id", "dod_converion"]])
+    df.to_csv(output_path, index=False)
+
+
+def evaluate_subgroups(enriched_path, output_path, n_permutations=10000):
+    """
+    Tests subgroup differences in severity scores and outcomes.
+
+    Parameters:
+    - enriched_path (str): Output of enrich.
+    - output_path (str): CSV with one row per tested column.
+    - n_permutations (int): Permutations per column. Default is 10000.
+
+    Returns:
+    - None
+    """
+    import pandas as pd
+    from LCA_Analysis.utils.significance import compare_subgroups
+
+    df = pd.read_csv(enriched_path)
+    compare_subgroups(
+        df,
+        score_columns=["sofa", "oasis"],
+        outcome_columns=["organ_dysfunction", "sepsis"],
+        n_permutations=n_permutations,
+        n_workers=1,
+    ).to_csv(output_path)
+
+
+def plot_characteristics(subgroups_path, plot_dir):
+    """
+    Bubble and age box plots of the subgroups.
+
+    Parameters:
+    - subgroups_path (str): Output of reassign.
+    - plot_dir (str): Plot directory.
+
+    Returns:
+    - None
+    """
+    _use_file_backend()
+    import pandas as pd
+    from LCA_Analysis.utils.visualization import plot_subgroup_characteristics
+
+    df = pd.read_csv(subgroups_path)
+    plot_subgroup_characteristics(df, save_plots=True, output_dir=plot_dir)
+
+
+def plot_roc(subgroups_path, plot_dir):
+    """
+    One-vs-rest ROC curves of the subgroups.
+
+    Parameters:
+    - subgroups_path (str): Output of reassign.
+    - plot_dir (str): Plot directory.
+
+    Returns:
+    - None
+    """
+    _use_file_backend()
+    import pandas as pd
+    from LCA_Analysis.utils.visualization import plot_roc_curves
+
+    df = pd.read_csv(subgroups_path)
+    plot_roc_curves(df, LCA_COLUMNS, ROC_COLORS, save_plots=True,
+                    output_dir=plot_dir)
+
+
+def plot_prevalence(subgroups_path, plot_dir):
+    """
+    Polar plots of the comorbidity prevalences, overall and per subgroup.
+
+    Parameters:
+    - subgroups_path (str): Output of reassign.
+    - plot_dir (str): Plot directory.
+
+    Returns:
+    - None
+    """
+    _use_file_backend()
+    import pandas as pd
+    from LCA_Analysis.utils.data_preprocessing import (
+        get_morbidity_columns_and_distribution,
+    )
+    from LCA_Analysis.utils.visualization import (
+        plot_polar_all, plot_polar_subgroup,
+    )
+
+    df = pd.read_csv(subgroups_path)
+    target_columns, _ = get_morbidity_columns_and_distribution(
+        df.drop(columns=["percent"], errors="ignore"),
+        display_distribution=False,
+    )
+    plot_polar_all(df[target_columns].mean(), save_plots=True,
+                   output_dir=plot_dir)
+    plot_polar_subgroup(
+        df.groupby("class_assignment")[target_columns].mean().clip(upper=0.5),
+        save_plots=True,
+        output_dir=plot_dir,
+    )
+
+
+def plot_severity(enriched_path, plot_dir):
+    """
+    SOFA and OASIS box plots and the organ dysfunction and sepsis
+    prevalence bar plot.
+
+    Parameters:
+    - enriched_path (str): Output of enrich.
+    - plot_dir (str): Plot directory.
+
+    Returns:
+    - None
+    """
+    _use_file_backend()
+    import pandas as pd
+    from LCA_Analysis.utils.data_postprocessing import calculate_prevalence
+    from LCA_Analysis.utils.visualization import (
+        plot_bar, plot_boxplot_by_subgroup,
+    )
+
+    df = pd.read_csv(enriched_path)
+    for score in ["sofa", "oasis"]:
+        plot_boxplot_by_subgroup(df, score, save_plots=True,
+                                 output_dir=plot_dir)
+        # Both scores are saved under the same name; keep one file each
+        shutil.move(
+            os.path.join(plot_dir, "plot_boxplot_by_subgroup.png"),
+            os.path.join(plot_dir, f"plot_boxplot_{score}.png"),
+        )
+    percentages = calculate_prevalence(
+        df, ["organ_dysfunction", "sepsis"], "Subgroup"
+    )
+    plot_bar(percentages, colors=PREVALENCE_COLORS, save_plots=True,
+             output_dir=plot_dir)
+
+
+def run_kmeans(age_path, age_group_path, output_dir, clusters_count=6,
+               group_clusters_count=3):
+    """
+    Runs both k-means analyses of kmeans_clustering/analysis.ipynb.
+
+    Parameters:
+    - age_path (str): patients_w_elixhauser_age.csv.
+    - age_group_path (str): patients_w_elixhauser_age_group.csv.
+    - output_dir (str): Directory for kmeans_w_age.csv and
+      kmeans_by_age_group.csv.
+    - clusters_count (int): Clusters of kmeans_w_age. Default is 6.
+    - group_clusters_count (int): Clusters of kmeans_by_age_group.
+      Default is 3.
+
+    Returns:
+    - None
+    """
+    import pandas as pd
+    from kmeans_clustering.analysis.kmeans_by_age_group import (
+        kmeans_by_age_group,
+    )
+    from kmeans_clustering.analysis.kmeans_w_age import kmeans_w_age
+
+    _, df = kmeans_w_age(pd.read_csv(age_path), clusters_count=clusters_count,
+                         bin_age=True)
+    df.to_csv(os.path.join(output_dir, "kmeans_w_age.csv"), index=False)
+    _, df = kmeans_by_age_group(pd.read_csv(age_group_path),
+                                clusters_count=group_clusters_count)
+    df.to_csv(os.path.join(output_dir, "kmeans_by_age_group.csv"))
@@ -0,0 +1,220 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from LCA_Analysis.utils.data_preprocessing import (  # noqa: F401
+    AGE_BUCKET_BINS,
+    AGE_BUCKET_LABELS,
+    assign_age_bucket,
+)
+
+# Columns read from each raw MIMIC table
+COHORT_SOURCE_COLUMNS = {
+    "patients": ["subject_id", "gender", "dob"],
+    "icustays": ["subject_id", "hadm_id", "icustay_id", "intime", "outtime"],
+    "admissions": [
+        "hadm_id", "admittime", "dischtime", "deathtime", "admission_type",
+    ],
+}
+
+# Column types of the cohort artifact, in output order
+COHORT_DTYPES = {
+    "subject_id": "int32",
+    "hadm_id": "int32",
+    "icustay_id": "int32",
+    "deathtime": "datetime64[ns]",
+    "icu_intime": "datetime64[ns]",
+    "icu_outtime": "datetime64[ns]",
+    "admittime": "datetime64[ns]",
+    "dischtime": "datetime64[ns]",
+    "gender": "category",
+    "age_at_admission": "int16",
+    "admission_type": "category",
+    "los_icu_days": "float64",
+    "los_hospital_days": "float64",
+}
+
+SECONDS_PER_DAY = 86400
+
+
+def load_cohort_tables(data_dir):
+    """
+    Reads the columns needed for the cohort from the raw MIMIC parquet
+    files.
+
+    Parameters:
+    - data_dir (str): Directory with patients.parquet, icustays.parquet and
+      admissions.parquet (the layout used by local_engine).
+
+    Returns:
+    - dict: Table name -> DataFrame with lowercase column names.
+    """
+    tables = {}
+    for table, columns in COHORT_SOURCE_COLUMNS.items():
+        path = os.path.join(data_dir, f"{table}.parquet")
+        if not os.path.exists(path):
+            path = os.path.join(data_dir, table)
+        tables[table] = pd.read_parquet(path, columns=columns)
+    return tables
+
+
+def age_in_years(start, end):
+    """
+    Completed years between two datetime columns, matching PostgreSQL's
+    EXTRACT(YEAR FROM age(end, start)).
+
+    Parameters:
+    - start (pd.Series): Earlier datetimes, e.g. date of birth.
+    - end (pd.Series): Later datetimes, e.g. ICU admission time.
+
+    Returns:
+    - np.ndarray: Whole years as int64.
+    """
+    start = pd.to_datetime(start).dt
+    end = pd.to_datetime(end).dt
+    years = (end.year - start.year).to_numpy()
+
+    # One year less if the anniversary has not been reached yet
+    start_key = (start.month * 100 + start.day).to_numpy()
+    end_key = (end.month * 100 + end.day).to_numpy()
+    start_time = (start.hour * 3600 + start.minute * 60
+                  + start.second).to_numpy()
+    end_time = (end.hour * 3600 + end.minute * 60 + end.second).to_numpy()
+    before_anniversary = (end_key < start_key) | (
+        (end_key == start_key) & (end_time < start_time)
+    )
+    return years - before_anniversary
+
+
+def build_cohort(patients, icustays, admissions, min_age=16, max_age=95):
+    """
+    Builds the study cohort of filter_patients_by_age.sql from the raw
+    tables: each patient's first ICU stay, aged min_age to max_age at ICU
+    admission, with the Elective/Non-Elective admission type recode and ICU
+    and hospital length of stay.
+
+    The first stay is picked with one sort by (subject_id, intime) and a
+    groupby-first, and ages and lengths of stay are computed on datetime64
+    columns, so no per-patient subquery is needed.
+
+    Parameters:
+    - patients (pd.DataFrame): MIMIC patients table.
+    - icustays (pd.DataFrame): MIMIC icustays table.
+    - admissions (pd.DataFrame): MIMIC admissions table.
+    - min_age (int): Minimum age at ICU admission. Default is 16.
+    - max_age (int): Maximum age at ICU admission. Default is 95.
+
+    Returns:
+    - pd.DataFrame: One row per patient with the columns of the
+      included_patients view plus 'los_icu_days' and 'los_hospital_days',
+      typed as in COHORT_DTYPES.
+    """
+    patients = patients.rename(columns=str.lower)
+    icustays = icustays.rename(columns=str.lower)
+    admissions = admissions.rename(columns=str.lower)
+
+    icustays = icustays[COHORT_SOURCE_COLUMNS["icustays"]].copy()
+    icustays["intime"] = pd.to_datetime(icustays["intime"])
+    icustays["outtime"] = pd.to_datetime(icustays["outtime"])
+
+    first_stays = (
+        icustays.dropna(subset=["intime"])
+        .sort_values(["subject_id", "intime"], kind="stable")
+        .groupby("subject_id", sort=False)
+        .head(1)
+    )
+
+    cohort = first_stays.merge(
+        patients[COHORT_SOURCE_COLUMNS["patients"]],
+        on="subject_id",
+        how="inner",
+    ).merge(
+        admissions[COHORT_SOURCE_COLUMNS["admissions"]],
+        on="hadm_id",
+        how="inner",
+    )
+
+    cohort["age_at_admission"] = age_in_years(
+        cohort["dob"], cohort["intime"]
+    )
+    cohort = cohort[cohort["age_at_admission"].between(min_age, max_age)]
+
+    cohort = cohort.rename(
+        columns={"intime": "icu_intime", "outtime": "icu_outtime"}
+    )
+    for column in ["admittime", "dischtime", "deathtime"]:
+        cohort[column] = pd.to_datetime(cohort[column])
+
+    cohort["admission_type"] = np.where(
+        cohort["admission_type"] == "ELECTIVE", "Elective", "Non-Elective"
+    )
+    cohort["los_icu_days"] = (
+        (cohort["icu_outtime"] - cohort["icu_intime"]).dt.total_seconds()
+        / SECONDS_PER_DAY
+    )
+    cohort["los_hospital_days"] = (
+        (cohort["dischtime"] - cohort["admittime"]).dt.total_seconds()
+        / SECONDS_PER_DAY
+    )
+
+    cohort = cohort[list(COHORT_DTYPES)].astype(COHORT_DTYPES)
+    return cohort.sort_values("subject_id").reset_index(drop=True)
+
+
+def write_cohort(cohort, path):
+    """
+    Writes the cohort as a typed parquet file.
+
+    Parameters:
+    - cohort (pd.DataFrame): Output of build_cohort.
+    - path (str): Destination .parquet path; parent directories are created.
+
+    Returns:
+    - str: The path written.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    cohort.to_parquet(path, index=False)
+    return path
+
+
+def read_cohort(path, columns=None):
+    """
+    Reads a cohort written by write_cohort.
+
+    Parameters:
+    - path (str): Path to the cohort parquet file.
+    - columns (list): Columns to read. Default reads all of them.
+
+    Returns:
+    - pd.DataFrame: The cohort with its stored types.
+    """
+    return pd.read_parquet(path, columns=columns)
+
+
+def build_cohort_from_parquet(data_dir, output_path=None, min_age=16,
+                              max_age=95):
+    """
+    Loads the raw tables, builds the cohort, and optionally writes it.
+
+    Parameters:
+    - data_dir (str): Directory with the raw MIMIC parquet files.
+    - output_path (str): Where to write the cohort parquet file. Default
+      does not write anything.
+    - min_age (int): Minimum age at ICU admission. Default is 16.
+    - max_age (int): Maximum age at ICU admission. Default is 95.
+
+    Returns:
+    - pd.DataFrame: The cohort.
+    """
+    tables = load_cohort_tables(data_dir)
+    cohort = build_cohort(
+        tables["patients"],
+        tables["icustays"],
+        tables["admissions"],
+        min_age=min_age,
+        max_age=max_age,
+    )
+    if output_path is not None:
+        write_cohort(cohort, output_path)
+    return cohort
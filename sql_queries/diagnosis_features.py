@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+from .elixhauser import iter_diagnosis_chunks
+
+
+def build_diagnosis_matrix(diagnoses, hadm_ids=None, code_length=None,
+                           min_admissions=1, exclude_primary=False,
+                           chunksize=1_000_000):
+    """
+    Builds a sparse admission x ICD-9 code indicator matrix from
+    diagnoses_icd in one streaming pass.
+
+    Only the (admission, code) pairs that occur are stored, so the full
+    code space (several thousand codes) fits in memory where a dense
+    matrix of the same width would not.
+
+    Parameters:
+    - diagnoses: diagnoses_icd as a DataFrame, an iterable of DataFrame
+      chunks, or a path to a parquet file/directory or CSV file, as in
+      derive_comorbidity_flags. Needs the columns 'hadm_id' and
+      'icd9_code', and 'seq_num' when exclude_primary is True.
+    - hadm_ids (array-like): Admissions to use as rows, in this order, e.g.
+      the cohort's hadm_id column. Admissions without diagnoses get an
+      empty row and diagnoses of other admissions are ignored. Default is
+      every admission in diagnoses, sorted.
+    - code_length (int): Truncate codes to this many characters, e.g. 3
+      for the three-digit ICD-9 categories. Default keeps the full codes.
+    - min_admissions (int): Drop codes found in fewer admissions. Default
+      is 1.
+    - exclude_primary (bool): Ignore the primary diagnosis (seq_num = 1).
+      Default is False.
+    - chunksize (int): Rows per chunk when reading. Default is 1,000,000.
+
+    Returns:
+    - dict: 'matrix' (scipy.sparse.csr_matrix of 0/1 float32 values, one
+      row per admission and one column per code), 'hadm_id' (row ids) and
+      'codes' (column codes, sorted).
+    """
+    from scipy import sparse
+
+    columns = ["hadm_id", "icd9_code", "seq_num"]
+    vocabulary = {}
+    row_keys = []
+    column_ids = []
+    for chunk in iter_diagnosis_chunks(diagnoses, chunksize, columns):
+        chunk = chunk.rename(columns=str.lower)
+        chunk = chunk.dropna(subset=["hadm_id", "icd9_code"])
+        if exclude_primary and "seq_num" in chunk:
+            chunk = chunk[chunk["seq_num"] != 1]
+        if chunk.empty:
+            continue
+
+        codes = chunk["icd9_code"].astype(str).str.strip()
+        if code_length is not None:
+            codes = codes.str[:code_length]
+        # Map the chunk's distinct codes to global column ids once
+        local_ids, uniques = pd.factorize(codes)
+        for code in uniques:
+            vocabulary.setdefault(code, len(vocabulary))
+        global_ids = np.fromiter(
+            (vocabulary[code] for code in uniques),
+            dtype=np.int32,
+            count=len(uniques),
+        )
+        row_keys.append(chunk["hadm_id"].to_numpy(dtype=np.int64))
+        column_ids.append(global_ids[local_ids])
+
+    keys = np.concatenate(row_keys) if row_keys else np.array([], np.int64)
+    cols = np.concatenate(column_ids) if column_ids \
+        else np.array([], np.int32)
+
+    if hadm_ids is None:
+        hadm_ids, rows = np.unique(keys, return_inverse=True)
+    else:
+        hadm_ids = np.asarray(hadm_ids, dtype=np.int64)
+        rows = pd.Index(hadm_ids).get_indexer(keys)
+        found = rows >= 0
+        rows = rows[found]
+        cols = cols[found]
+
+    # Columns in code order, so the layout does not depend on row order
+    codes = np.array(list(vocabulary), dtype=object)
+    code_order = np.argsort(codes)
+    column_position = np.empty(len(codes), dtype=np.int32)
+    column_position[code_order] = np.arange(len(codes))
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32),
+         (rows, column_position[cols])),
+        shape=(len(hadm_ids), len(codes)),
+    )
+    # Repeated (admission, code) pairs were summed; keep indicators
+    matrix.data[:] = 1.0
+    codes = codes[code_order]
+
+    if min_admissions > 1:
+        keep = np.flatnonzero(matrix.getnnz(axis=0) >= min_admissions)
+        matrix = matrix[:, keep]
+        codes = codes[keep]
+
+    return {"matrix": matrix, "hadm_id": hadm_ids, "codes": list(codes)}
+
+
+def combine_features(df, feature_columns, features):
+    """
+    Puts dense DataFrame columns (e.g. age, gender, Elixhauser flags) and a
+    sparse feature matrix side by side without densifying the matrix.
+
+    Parameters:
+    - df (pd.DataFrame): Rows aligned with the rows of features.
+    - feature_columns (list): Numeric columns of df to include.
+    - features (scipy.sparse matrix): Sparse features, e.g. the 'matrix' of
+      build_diagnosis_matrix.
+
+    Returns:
+    - scipy.sparse.csr_matrix: The dense columns followed by the sparse
+      ones.
+    """
+    from scipy import sparse
+
+    if features.shape[0] != len(df):
+        raise ValueError("df and features must have the same number of rows")
+    dense = sparse.csr_matrix(
+        df[list(feature_columns)].to_numpy(dtype=np.float64)
+    )
+    return sparse.hstack([dense, features], format="csr")
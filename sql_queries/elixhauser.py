@@ -0,0 +1,381 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# ICD-9 code prefixes for the 30 Elixhauser categories, following the
+# Quan et al. (2005) enhanced ICD-9-CM definitions used by the
+# mimiciii.elixhauser_quan view. A code belongs to a category when it starts
+# with any of the category's prefixes; full five-character codes are exact
+# matches. Keys are ordered and named like the elixhauser_quan columns.
+ELIXHAUSER_QUAN_ICD9 = {
+    "congestive_heart_failure": [
+        "39891", "40201", "40211", "40291", "40401", "40403", "40411",
+        "40413", "40491", "40493", "4254", "4255", "4257", "4258", "4259",
+        "428",
+    ],
+    "cardiac_arrhythmias": [
+        "42613", "42610", "42612", "99601", "99604", "4260", "4267", "4269",
+        "4270", "4271", "4272", "4273", "4274", "4276", "4278", "4279",
+        "7850", "V450", "V533",
+    ],
+    "valvular_disease": [
+        "0932", "7463", "7464", "7465", "7466", "V422", "V433", "394", "395",
+        "396", "397", "424",
+    ],
+    "pulmonary_circulation": ["4150", "4151", "4170", "4178", "4179", "416"],
+    "peripheral_vascular": [
+        "0930", "4373", "4431", "4432", "4438", "4439", "4471", "5571",
+        "5579", "V434", "440", "441",
+    ],
+    # Uncomplicated and complicated hypertension are a single column
+    "hypertension": ["401", "402", "403", "404", "405"],
+    "paralysis": [
+        "3341", "3440", "3441", "3442", "3443", "3444", "3445", "3446",
+        "3449", "342", "343",
+    ],
+    "other_neurological": [
+        "33392", "3319", "3320", "3321", "3334", "3335", "3362", "3481",
+        "3483", "7803", "7843", "334", "335", "340", "341", "345",
+    ],
+    "chronic_pulmonary": [
+        "4168", "4169", "5064", "5081", "5088", "490", "491", "492", "493",
+        "494", "495", "496", "500", "501", "502", "503", "504", "505",
+    ],
+    "diabetes_uncomplicated": ["2500", "2501", "2502", "2503"],
+    "diabetes_complicated": [
+        "2504", "2505", "2506", "2507", "2508", "2509",
+    ],
+    "hypothyroidism": ["2409", "2461", "2468", "243", "244"],
+    "renal_failure": [
+        "40301", "40311", "40391", "40402", "40403", "40412", "40413",
+        "40492", "40493", "5880", "V420", "V451", "585", "586", "V56",
+    ],
+    "liver_disease": [
+        "07022", "07023", "07032", "07033", "07044", "07054", "0706", "0709",
+        "4560", "4561", "4562", "5722", "5723", "5724", "5728", "5733",
+        "5734", "5738", "5739", "V427", "570", "571",
+    ],
+    "peptic_ulcer": [
+        "5317", "5319", "5327", "5329", "5337", "5339", "5347", "5349",
+    ],
+    "aids": ["042", "043", "044"],
+    "lymphoma": ["2030", "2386", "200", "201", "202"],
+    "metastatic_cancer": ["196", "197", "198", "199"],
+    "solid_tumor": [
+        str(code) for code in list(range(140, 173)) + list(range(174, 196))
+    ],
+    "rheumatoid_arthritis": [
+        "72889", "72930", "7010", "7100", "7101", "7102", "7103", "7104",
+        "7108", "7109", "7112", "7193", "7285", "446", "714", "720", "725",
+    ],
+    "coagulopathy": ["2871", "2873", "2874", "2875", "286"],
+    "obesity": ["2780"],
+    "weight_loss": ["7832", "7994", "260", "261", "262", "263"],
+    "fluid_electrolyte": ["2536", "276"],
+    "blood_loss_anemia": ["2800"],
+    "deficiency_anemias": ["2801", "2808", "2809", "281"],
+    "alcohol_abuse": [
+        "2652", "2911", "2912", "2913", "2915", "2918", "2919", "3030",
+        "3039", "3050", "3575", "4255", "5353", "5710", "5711", "5712",
+        "5713", "V113", "980",
+    ],
+    "drug_abuse": [
+        "V6542", "3052", "3053", "3054", "3055", "3056", "3057", "3058",
+        "3059", "292", "304",
+    ],
+    "psychoses": ["29604", "29614", "29644", "29654", "2938", "295", "297",
+                  "298"],
+    "depression": ["2962", "2963", "2965", "3004", "309", "311"],
+}
+
+# Codes used for the sepsis flags in import_tables_LCA_post_analysis.sql
+SEPSIS_ICD9 = {
+    "severe_sepsis": ["99592"],
+    "septic_shock": ["78552"],
+}
+
+# Category -> category that overrides it, as in elixhauser_quan: a patient
+# with complicated diabetes (or metastatic cancer) is not also counted as
+# uncomplicated diabetes (or solid tumor)
+ELIXHAUSER_HIERARCHY = {
+    "diabetes_uncomplicated": "diabetes_complicated",
+    "solid_tumor": "metastatic_cancer",
+}
+
+DEFAULT_DEFINITIONS = {**ELIXHAUSER_QUAN_ICD9, **SEPSIS_ICD9}
+
+
+def compile_code_index(definitions=None):
+    """
+    Precompiles category definitions into a prefix index.
+
+    Every prefix is stored once, keyed by its length, together with the
+    bitmask of the categories it belongs to (a prefix may belong to several
+    categories, e.g. '4255' is both heart failure and alcohol abuse). Looking
+    up a code is then one dictionary probe per distinct prefix length.
+
+    Parameters:
+    - definitions (dict): Mapping of category name to a list of ICD-9 code
+      prefixes. Default is the Elixhauser categories plus severe sepsis and
+      septic shock.
+
+    Returns:
+    - dict: The index, with keys 'categories' (list of names in bit order),
+      'dtype' (unsigned integer type wide enough for one bit per category)
+      and 'prefix_masks' (dict of prefix length -> {prefix: bitmask}).
+    """
+    if definitions is None:
+        definitions = DEFAULT_DEFINITIONS
+
+    categories = list(definitions)
+    if len(categories) <= 32:
+        dtype = np.uint32
+    elif len(categories) <= 64:
+        dtype = np.uint64
+    else:
+        raise ValueError(
+            f"At most 64 categories are supported, got {len(categories)}"
+        )
+
+    prefix_masks = {}
+    for bit, category in enumerate(categories):
+        for prefix in definitions[category]:
+            prefix = prefix.replace(".", "").strip().upper()
+            masks = prefix_masks.setdefault(len(prefix), {})
+            masks[prefix] = masks.get(prefix, 0) | (1 << bit)
+
+    return {
+        "categories": categories,
+        "dtype": dtype,
+        "prefix_masks": prefix_masks,
+    }
+
+
+def code_masks(codes, index):
+    """
+    Maps ICD-9 codes to category bitmasks.
+
+    Parameters:
+    - codes (array-like): ICD-9 codes without dots; missing values are
+      allowed and map to 0.
+    - index (dict): Index from compile_code_index.
+
+    Returns:
+    - np.ndarray: One bitmask per code, of the index's dtype.
+    """
+    codes = pd.Series(codes, dtype="string").str.upper()
+    masks = np.zeros(len(codes), dtype=index["dtype"])
+    for length, prefix_masks in index["prefix_masks"].items():
+        matched = codes.str[:length].map(prefix_masks)
+        masks |= matched.fillna(0).to_numpy(dtype=index["dtype"])
+    return masks
+
+
+def _or_reduce_by_key(keys, masks):
+    """
+    Combines bitmasks that share a key with a bitwise OR.
+
+    Parameters:
+    - keys (np.ndarray): Integer keys, e.g. hadm_id.
+    - masks (np.ndarray): Bitmasks aligned with keys.
+
+    Returns:
+    - tuple: (sorted unique keys, OR-reduced bitmask per key).
+    """
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    masks = masks[order]
+    unique_keys, starts = np.unique(keys, return_index=True)
+    if len(unique_keys) == 0:
+        return unique_keys, masks[:0]
+    return unique_keys, np.bitwise_or.reduceat(masks, starts)
+
+
+def iter_diagnosis_chunks(diagnoses, chunksize, columns):
+    """
+    Yields diagnoses_icd rows in chunks from a DataFrame, an iterable of
+    DataFrames, or a parquet/CSV file. This is the shared reader of
+    derive_comorbidity_flags and build_diagnosis_matrix, so neither has
+    to load the whole table at once.
+
+    Parameters:
+    - diagnoses: DataFrame, iterable of DataFrames (yielded as they are),
+      or path to a parquet file, a directory of parquet files or a CSV
+      file.
+    - chunksize (int): Rows per chunk when slicing a DataFrame or reading
+      a file.
+    - columns (list): Lower-case names of the columns to read from a file.
+      Columns the file does not have are skipped; CSV headers are matched
+      case-insensitively and icd9_code is read as text, so leading zeros
+      are kept.
+
+    Returns:
+    - generator: DataFrame chunks. Column names keep the case of the
+      source.
+    """
+    if isinstance(diagnoses, pd.DataFrame):
+        for start in range(0, len(diagnoses), chunksize):
+            yield diagnoses.iloc[start:start + chunksize]
+    elif isinstance(diagnoses, (str, os.PathLike)):
+        path = os.fspath(diagnoses)
+        if path.endswith(".parquet") or os.path.isdir(path):
+            import pyarrow.dataset as ds
+
+            dataset = ds.dataset(path, format="parquet")
+            columns = [
+                column for column in columns
+                if column in dataset.schema.names
+            ]
+            for batch in dataset.to_batches(columns=columns,
+                                            batch_size=chunksize):
+                yield batch.to_pandas()
+        else:
+            yield from pd.read_csv(
+                path,
+                usecols=lambda column: column.lower() in columns,
+                dtype={"icd9_code": "string", "ICD9_CODE": "string"},
+                chunksize=chunksize,
+            )
+    else:
+        yield from diagnoses
+
+
+def derive_comorbidity_flags(diagnoses, definitions=None,
+                             exclude_primary=True, primary_categories=None,
+                             chunksize=1_000_000):
+    """
+    Derives per-admission comorbidity flags directly from diagnoses_icd in
+    one streaming pass.
+
+    Each chunk's distinct codes are resolved against the prefix index once
+    and cached, the per-row bitmasks are OR-reduced by hadm_id, and the
+    partial results are merged at the end, so memory depends on the number
+    of admissions rather than the number of diagnosis rows.
+
+    Parameters:
+    - diagnoses: diagnoses_icd as a DataFrame, an iterable of DataFrame
+      chunks, or a path to a parquet file/directory or CSV file. Needs the
+      columns 'hadm_id' and 'icd9_code', and 'seq_num' when exclude_primary
+      is True.
+    - definitions (dict): Category name -> list of ICD-9 prefixes. Default
+      is the Elixhauser categories plus severe sepsis and septic shock.
+    - exclude_primary (bool): Ignore the primary diagnosis (seq_num = 1)
+      for comorbidity categories, as the elixhauser_quan view does. Default
+      is True.
+    - primary_categories (list): Categories that still count the primary
+      diagnosis when exclude_primary is True. Default is the sepsis
+      categories, which import_tables_LCA_post_analysis.sql derives from
+      all diagnoses.
+    - chunksize (int): Rows per chunk when reading. Default is 1,000,000.
+
+    Returns:
+    - dict: 'hadm_id' (sorted np.ndarray), 'flags' (bit-packed np.ndarray,
+      one unsigned integer per admission) and 'categories' (names in bit
+      order).
+    """
+    index = compile_code_index(definitions)
+    columns = ["hadm_id", "icd9_code", "seq_num"]
+    code_cache = {}
+
+    if primary_categories is None:
+        primary_categories = list(SEPSIS_ICD9)
+    primary_mask = index["dtype"](sum(
+        1 << bit for bit, category in enumerate(index["categories"])
+        if category in primary_categories
+    ))
+
+    partial_keys = []
+    partial_masks = []
+    for chunk in iter_diagnosis_chunks(diagnoses, chunksize, columns):
+        chunk = chunk.rename(columns=str.lower)
+        chunk = chunk.dropna(subset=["hadm_id", "icd9_code"])
+        if chunk.empty:
+            continue
+
+        codes, uniques = pd.factorize(chunk["icd9_code"])
+        new_codes = [code for code in uniques if code not in code_cache]
+        if new_codes:
+            code_cache.update(zip(new_codes, code_masks(new_codes, index)))
+        unique_masks = np.fromiter(
+            (code_cache[code] for code in uniques),
+            dtype=index["dtype"],
+            count=len(uniques),
+        )
+
+        masks = unique_masks[codes]
+        if exclude_primary and "seq_num" in chunk:
+            is_primary = (chunk["seq_num"] == 1).to_numpy()
+            masks[is_primary] &= primary_mask
+
+        keys, masks = _or_reduce_by_key(
+            chunk["hadm_id"].to_numpy(dtype=np.int64), masks
+        )
+        partial_keys.append(keys)
+        partial_masks.append(masks)
+
+    if partial_keys:
+        hadm_ids, flags = _or_reduce_by_key(
+            np.concatenate(partial_keys), np.concatenate(partial_masks)
+        )
+    else:
+        hadm_ids = np.array([], dtype=np.int64)
+        flags = np.array([], dtype=index["dtype"])
+
+    return {
+        "hadm_id": hadm_ids,
+        "flags": flags,
+        "categories": index["categories"],
+    }
+
+
+def unpack_comorbidity_flags(result, hierarchy=None, hadm_ids=None):
+    """
+    Expands bit-packed flags into one 0/1 column per category, in the same
+    layout as the elixhauser_quan view.
+
+    Parameters:
+    - result (dict): Output of derive_comorbidity_flags.
+    - hierarchy (dict): Category -> overriding category; the category is
+      cleared wherever the overriding one is set. Default is
+      ELIXHAUSER_HIERARCHY (only applied to categories that are present).
+    - hadm_ids (array-like): Admissions to report, e.g. every hadm_id in
+      admissions. Admissions without coded diagnoses get all zeros. Default
+      is the admissions present in result.
+
+    Returns:
+    - pd.DataFrame: 'hadm_id' plus one int8 column per category, and a
+      'sepsis' column when severe sepsis and septic shock are both defined.
+    """
+    if hierarchy is None:
+        hierarchy = ELIXHAUSER_HIERARCHY
+
+    categories = result["categories"]
+    flags = result["flags"]
+    if hadm_ids is not None:
+        hadm_ids = np.asarray(hadm_ids, dtype=np.int64)
+        reindexed = np.zeros(len(hadm_ids), dtype=flags.dtype)
+        if len(flags):
+            positions = np.searchsorted(result["hadm_id"], hadm_ids)
+            positions = np.minimum(positions, len(flags) - 1)
+            found = result["hadm_id"][positions] == hadm_ids
+            reindexed[found] = flags[positions[found]]
+        flags = reindexed
+    else:
+        hadm_ids = result["hadm_id"]
+
+    bits = np.arange(len(categories), dtype=flags.dtype)
+    matrix = ((flags[:, None] >> bits) & 1).astype(np.int8)
+    df = pd.DataFrame(matrix, columns=categories)
+
+    for category, overriding in hierarchy.items():
+        if category in df and overriding in df:
+            df.loc[df[overriding] == 1, category] = 0
+
+    if "severe_sepsis" in df and "septic_shock" in df:
+        df["sepsis"] = (df["severe_sepsis"] | df["septic_shock"]).astype(
+            np.int8
+        )
+
+    df.insert(0, "hadm_id", hadm_ids)
+    return df
@@ -0,0 +1,340 @@
+import os
+import re
+
+# Tables the SQL scripts read from the mimiciii schema. Each one is expected
+# as '<name>.parquet' (or a directory of parquet parts named '<name>') in the
+# data directory passed to connect_local_mimic.
+MIMIC_TABLES = [
+    "patients",
+    "icustays",
+    "admissions",
+    "elixhauser_quan",
+    "sofa",
+    "diagnoses_icd",
+    "oasis",
+    "angus",
+]
+
+# Views created by the utilities scripts, in the order they depend on
+# each other
+VIEW_SCRIPTS = [
+    "utilities/filter_patients_by_admission_and_age.sql",
+    "utilities/filter_patients_by_age.sql",
+    "utilities/calculate_morbidity_counts.sql",
+]
+
+TABLE_ONE_SCRIPTS = [
+    "analysis/table_one_statistics/patient_statistics.sql",
+    "analysis/table_one_statistics/age_bucket_statistics.sql",
+    "analysis/table_one_statistics/gender_statistics.sql",
+    "analysis/table_one_statistics/admission_type_statistics.sql",
+    "analysis/table_one_statistics/disease_count_statistics.sql",
+]
+
+SQL_QUERIES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+COPY_PATTERN = re.compile(
+    r"^\\copy\s*\((?P<query>.*)\)\s*TO\s+'(?P<target>[^']+)'.*$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def _table_source(data_dir, table):
+    """
+    Finds the columnar file(s) that hold a MIMIC table.
+
+    Parameters:
+    - data_dir (str): Directory containing the parquet files.
+    - table (str): Lowercase table name, e.g. 'patients'.
+
+    Returns:
+    - str or None: A path or glob readable by read_parquet, or None if the
+      table is not present.
+    """
+    for name in (table, table.upper()):
+        file_path = os.path.join(data_dir, f"{name}.parquet")
+        if os.path.isfile(file_path):
+            return file_path
+        dir_path = os.path.join(data_dir, name)
+        if os.path.isdir(dir_path):
+            return os.path.join(dir_path, "*.parquet")
+    return None
+
+
+def connect_local_mimic(data_dir, tables=None, schema="mimiciii",
+                        database=":memory:", threads=None):
+    """
+    Opens an embedded DuckDB connection with the MIMIC tables exposed as
+    views over parquet files, so the scripts in sql_queries can run without
+    the PostgreSQL container.
+
+    The views read the parquet files directly; nothing is imported or
+    copied, and DuckDB only scans the columns each query touches.
+
+    Parameters:
+    - data_dir (str): Directory containing '<table>.parquet' files.
+    - tables (list): Tables to register. Default is MIMIC_TABLES; missing
+      optional tables are skipped.
+    - schema (str): Schema the views are created in. Default is 'mimiciii'
+      so that both qualified and unqualified table names resolve.
+    - database (str): DuckDB database path. Default is in-memory.
+    - threads (int): Number of DuckDB worker threads. Default lets DuckDB
+      use all cores.
+
+    Returns:
+    - duckdb.DuckDBPyConnection: The open connection.
+    """
+    import duckdb
+
+    if tables is None:
+        tables = MIMIC_TABLES
+
+    con = duckdb.connect(database)
+    if threads is not None:
+        con.execute(f"SET threads TO {int(threads)}")
+    con.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+    # Unqualified names in the scripts (e.g. 'icustays', 'unique_p') are
+    # looked up and created in the same schema, like psql's search_path
+    con.execute(f"SET schema = '{schema}'")
+
+    missing = []
+    for table in tables:
+        source = _table_source(data_dir, table)
+        if source is None:
+            missing.append(table)
+            continue
+        source = source.replace("'", "''")
+        con.execute(
+            f"CREATE OR REPLACE VIEW {schema}.{table} AS "
+            f"SELECT * FROM read_parquet('{source}')"
+        )
+
+    if missing:
+        print("Tables not found in", data_dir, ":", ", ".join(missing))
+
+    return con
+
+
+def _strip_comments(sql):
+    """
+    Removes '--' line comments that are outside string literals.
+
+    Parameters:
+    - sql (str): SQL text.
+
+    Returns:
+    - str: SQL text without line comments.
+    """
+    lines = []
+    for line in sql.splitlines():
+        in_string = False
+        for i, char in enumerate(line):
+            if char == "'":
+                in_string = not in_string
+            elif char == "-" and not in_string and line[i:i + 2] == "--":
+                line = line[:i]
+                break
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def split_sql_statements(sql):
+    """
+    Splits a psql script into statements on semicolons outside string
+    literals, after removing line comments.
+
+    Parameters:
+    - sql (str): Contents of a .sql file.
+
+    Returns:
+    - list: Non-empty statements without their trailing semicolon.
+    """
+    sql = _strip_comments(sql)
+    statements = []
+    current = []
+    in_string = False
+    for char in sql:
+        if char == "'":
+            in_string = not in_string
+        if char == ";" and not in_string:
+            statements.append("".join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    statements.append("".join(current).strip())
+    return [statement for statement in statements if statement]
+
+
+def translate_postgres_sql(statement):
+    """
+    Rewrites the PostgreSQL constructs used in sql_queries that DuckDB
+    does not accept as written.
+
+    - 'CREATE VIEW' becomes 'CREATE OR REPLACE VIEW' so scripts can be
+      rerun against the same connection.
+    - 'count(alias.*)' becomes 'count(*)'.
+    - 'AVG(a - b)' over timestamps is computed on epoch seconds, since
+      DuckDB cannot average intervals.
+
+    Parameters:
+    - statement (str): A single SQL statement.
+
+    Returns:
+    - str: The statement in DuckDB's dialect.
+    """
+    statement = re.sub(
+        r"\bCREATE\s+VIEW\b", "CREATE OR REPLACE VIEW", statement,
+        flags=re.IGNORECASE,
+    )
+    statement = re.sub(
+        r"\bcount\(\s*\w+\.\*\s*\)", "count(*)", statement,
+        flags=re.IGNORECASE,
+    )
+    statement = re.sub(
+        r"EXTRACT\(\s*EPOCH\s+FROM\s+"
+        r"AVG\(\s*([\w.]+)\s*-\s*([\w.]+)\s*\)\s*\)",
+        r"AVG(EXTRACT(EPOCH FROM (\1 - \2)))",
+        statement,
+        flags=re.IGNORECASE,
+    )
+    return statement
+
+
+def run_sql_script(con, script_path):
+    """
+    Runs a psql script from sql_queries on a local connection.
+
+    CREATE VIEW statements are executed for their side effect. SELECT
+    statements and '\\copy (...) TO ...' exports are returned as DataFrames
+    instead of being written to CSV; copy results are keyed by the stem of
+    the file they would have been written to.
+
+    Parameters:
+    - con (duckdb.DuckDBPyConnection): Connection from connect_local_mimic.
+    - script_path (str): Path to the .sql file, absolute or relative to the
+      sql_queries directory.
+
+    Returns:
+    - dict: Mapping of result name to DataFrame. Plain queries are named
+      after the script, with a numeric suffix when a script has several.
+    """
+    if not os.path.isabs(script_path) and not os.path.exists(script_path):
+        script_path = os.path.join(SQL_QUERIES_DIR, script_path)
+
+    with open(script_path) as f:
+        statements = split_sql_statements(f.read())
+
+    script_name = os.path.splitext(os.path.basename(script_path))[0]
+    results = {}
+    for statement in statements:
+        copy_match = COPY_PATTERN.match(statement)
+        if copy_match:
+            query = translate_postgres_sql(copy_match.group("query"))
+            target = copy_match.group("target")
+            name = os.path.splitext(os.path.basename(target))[0]
+            results[name] = con.execute(query).df()
+            continue
+
+        statement = translate_postgres_sql(statement)
+        if re.match(r"^\s*(WITH|SELECT)\b", statement, re.IGNORECASE):
+            name = script_name
+            if name in results:
+                name = f"{script_name}_{len(results)}"
+            results[name] = con.execute(statement).df()
+        else:
+            con.execute(statement)
+
+    return results
+
+
+def create_cohort_views(con):
+    """
+    Creates the unique_p, included_patients and morbidity_counts views that
+    the analysis scripts depend on.
+
+    Parameters:
+    - con (duckdb.DuckDBPyConnection): Connection from connect_local_mimic.
+
+    Returns:
+    - None
+    """
+    for script in VIEW_SCRIPTS:
+        run_sql_script(con, script)
+
+
+def run_table_one_statistics(con):
+    """
+    Runs every table-one statistics script, creating the cohort views first.
+
+    Parameters:
+    - con (duckdb.DuckDBPyConnection): Connection from connect_local_mimic.
+
+    Returns:
+    - dict: Mapping of script name (e.g. 'gender_statistics') to DataFrame.
+    """
+    create_cohort_views(con)
+    results = {}
+    for script in TABLE_ONE_SCRIPTS:
+        results.update(run_sql_script(con, script))
+    return results
+
+
+def convert_csv_to_parquet(csv_dir, data_dir, tables=None):
+    """
+    One-off conversion of MIMIC CSV exports (e.g. 'PATIENTS.csv.gz' from
+    PhysioNet, or '\\copy' exports of the concept views) to parquet files
+    that connect_local_mimic can read.
+
+    Parameters:
+    - csv_dir (str): Directory containing '<table>.csv' or '<table>.csv.gz'
+      files, in lower or upper case.
+    - data_dir (str): Directory to write '<table>.parquet' files to.
+    - tables (list): Tables to convert. Default is MIMIC_TABLES.
+
+    Returns:
+    - list: Names of the tables that were converted.
+    """
+    import duckdb
+
+    if tables is None:
+        tables = MIMIC_TABLES
+
+    os.makedirs(data_dir, exist_ok=True)
+    converted = []
+    con = duckdb.connect()
+    try:
+        for table in tables:
+            for name in (table, table.upper()):
+                candidates = [
+                    os.path.join(csv_dir, f"{name}.csv{suffix}")
+                    for suffix in ("", ".gz")
+                ]
+                source = next(
+                    (path for path in candidates if os.path.isfile(path)),
+                    None,
+                )
+                if source is not None:
+                    break
+            if source is None:
+                continue
+
+            target = os.path.join(data_dir, f"{table}.parquet")
+            source = source.replace("'", "''")
+            target_sql = target.replace("'", "''")
+            # Lowercase column names to match the PostgreSQL build
+            columns = con.execute(
+                f"DESCRIBE SELECT * FROM read_csv_auto('{source}')"
+            ).fetchall()
+            select_list = ", ".join(
+                f'"{column[0]}" AS "{column[0].lower()}"'
+                for column in columns
+            )
+            con.execute(
+                f"COPY (SELECT {select_list} FROM read_csv_auto('{source}')) "
+                f"TO '{target_sql}' (FORMAT PARQUET)"
+            )
+            converted.append(table)
+    finally:
+        con.close()
+
+    return converted